@@ -6,3 +6,4 @@ __softname__ = 'fenci'
 __version__ = '0.3.4'
 
 from .segment import Segment
+from .async_segment import AsyncSegment
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+asyncio 分词接口
+
+分词放到executor里面执行，不阻塞事件循环。同一时间窗口内的多个请求会合并成一批，
+交给 Segment.lcut_many 一次完成，然后各自拿到自己的结果。
+"""
+
+import asyncio
+
+from .segment import Segment
+from .utils import strdecode
+
+
+class AsyncSegment(object):
+    def __init__(self, segment=None, executor=None, batch_window=0.002,
+                 max_batch_size=128):
+        """
+        :param segment: 使用的分词器 默认新建一个 Segment
+        :param executor: 分词在这里面执行 默认为事件循环的默认executor
+        :param batch_window: 第一个请求到达后最多等待多少秒凑成一批
+        :param max_batch_size: 一批最多多少个请求 凑满立即执行
+        """
+        self.segment = segment if segment is not None else Segment()
+        self.executor = executor
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+
+        self._pending = []
+        self._flush_handle = None
+        self._init_future = None
+
+    async def initialize(self):
+        """
+        在executor里面初始化模型 多个协程同时调用也只初始化一次
+        """
+        if self.segment.initialized:
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._init_future is None:
+            self._init_future = loop.run_in_executor(
+                self.executor, self.segment.check_initialized)
+
+        try:
+            await asyncio.shield(self._init_future)
+        except Exception:
+            self._init_future = None
+            raise
+
+    async def lcut(self, sentence):
+        if not self.segment.initialized:
+            await self.initialize()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((strdecode(sentence), future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window,
+                                                 self._flush)
+
+        return await future
+
+    async def cut(self, sentence):
+        for word in await self.lcut(sentence):
+            yield word
+
+    async def lcut_many(self, sentences):
+        return await asyncio.gather(*[self.lcut(s) for s in sentences])
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch = self._pending
+        self._pending = []
+        if not batch:
+            return
+
+        loop = asyncio.get_running_loop()
+        sentences = [sentence for sentence, future in batch]
+        batch_future = loop.run_in_executor(self.executor,
+                                            self.segment.lcut_many, sentences)
+
+        def dispatch(done):
+            exc = asyncio.CancelledError() if done.cancelled() else \
+                done.exception()
+            if exc is not None:
+                for sentence, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+
+            for (sentence, future), words in zip(batch, done.result()):
+                if not future.done():  # 调用方可能已经取消
+                    future.set_result(words)
+
+        batch_future.add_done_callback(dispatch)
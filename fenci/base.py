@@ -1,23 +1,47 @@
-#!/usr/bin/env python
-# -*-coding:utf-8-*-
-
-from abc import ABC, abstractmethod
-import os
-import tempfile
-
-
-class BaseSegment(ABC):
-
-    @abstractmethod
-    def initialize(self):
-        pass
-
-    def check_initialized(self):
-        if not self.initialized:
-            self.initialize()
-
-    def _get_cache_file(self):
-        cache_file = os.path.join(self.tmp_dir or tempfile.gettempdir(),
-                                  self.cache_file)
-        self.tmp_dir = os.path.dirname(cache_file)
-        return cache_file
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+from abc import ABC, abstractmethod
+import os
+import threading
+
+from .cache import get_cache_dir
+
+class BaseSegment(ABC):
+    def __init__(self):
+        # 多个线程同时第一次调用时 保证只初始化一次
+        # 不同的分词器各自一把锁 共用的模型由 get_shared_model 按配置加锁载入
+        self._init_lock = threading.RLock()
+        # 修改模型的线程之间互斥 分词的线程读取模型不加锁 各个分词器互不影响
+        self._update_lock = threading.RLock()
+
+    def __getstate__(self):
+        """
+        锁不能pickle 到了子进程重新创建
+        """
+        state = self.__dict__.copy()
+        del state['_init_lock']
+        del state['_update_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_lock = threading.RLock()
+        self._update_lock = threading.RLock()
+
+    @abstractmethod
+    def initialize(self):
+        pass
+
+    def check_initialized(self):
+        if not self.initialized:
+            with self._init_lock:
+                if not self.initialized:
+                    self.initialize()
+
+    def _get_cache_file(self):
+        cache_file = os.path.join(self.tmp_dir or get_cache_dir(),
+                                  self.cache_file)
+        self.tmp_dir = os.path.dirname(cache_file)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return cache_file
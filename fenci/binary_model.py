@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+二进制模型文件
+
+词典和HMM模型都以紧凑的数组形式存放，载入时直接mmap只读映射，
+多个进程映射同一个文件时共用操作系统的页缓存，每个进程不再各自持有一份字典。
+
+分节的文件格式同时也用于模型缓存 见 cache.py （小端）：
+    header: magic(8s) schema(I) 节数(I) 保留(Q)
+    节表: 每节 名称(16s) 偏移(Q) 长度(Q)
+    各节数据 按8字节对齐
+
+词典各节：
+    words           排好序的词语utf8编码拼接
+    word_offsets    array('I') 第i个词语在文件中的绝对偏移 共 n+1 个
+    word_freqs      array('q') 词频 add_word 可以给负数 用有符号的
+    word_logfreqs   array('d')
+    word_hash       array('Q') 词语和前缀的开放寻址散列表 见 frozen_dict.build_hash_table
+    word_prefixes   不是词语的前缀 以\0分隔 载入为普通词典时不必再计算前缀词典
+HMM各节：
+    hmm_chars       array('I') 排好序的字符码点
+    hmm_emit        array('d') 4 x 字符数 的对数发射概率 没有的记为nan
+    hmm_emit_counts array('Q') 4 x 字符数 的原始发射计数 继续训练时用
+meta 节为json：总词频 转移矩阵 以及来源等信息
+"""
+
+import os
+import sys
+import json
+import math
+import mmap
+import struct
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+from .nltk_utils import FreqDist
+from .frozen_dict import FrozenWordDict, build_hash_table
+from .model import DictModel, get_shared_model, gen_prefix_dict
+
+MAGIC = b'FENCIMDL'
+SCHEMA_VERSION = 2
+
+HEADER = struct.Struct('<8sIIQ')
+SECTION = struct.Struct('<16sQQ')
+
+HMM_STATES = 'BEMS'
+HMM_SECTION_NAMES = ('hmm_chars', 'hmm_emit', 'hmm_emit_counts')
+
+SEP = '\0'
+
+MIN_FLOAT = -3.14e100
+
+
+class BinaryFormatError(Exception):
+    pass
+
+
+def _align(n):
+    return (n + 7) // 8 * 8
+
+
+def log_prob_table(counts):
+    """
+    由计数算出对数概率 直接生成新的字典 不必先复制一份计数
+    :param counts: {状态: {字符或者状态: 计数}}
+    :return:
+    """
+    table = {}
+    for k, v in counts.items():
+        total = sum(v.values())
+        table[k] = {k2: math.log(v[k2] / total) for k2 in v}
+    return table
+
+
+def hmm_sections(hmm_model_data):
+    """
+    HMM模型的各节 每个字符四个状态的对数发射概率和原始发射计数按同样的顺序排列
+    :param hmm_model_data: {'P_emit': 原始发射计数, 'P_trans': 原始转移计数}
+    :return: (各节, 需要写入meta的转移矩阵)
+    """
+    P_emit = hmm_model_data['P_emit']
+    P_trans = hmm_model_data['P_trans']
+    chars = sorted(set().union(*[P_emit.get(state, {}) for state in
+                                 HMM_STATES]))
+    if any(len(char) != 1 for char in chars):
+        raise Exception('HMM emission keys must be single characters.')
+
+    log_emit = log_prob_table(P_emit)
+    emit = array('d')
+    emit_counts = array('Q')
+    for state in HMM_STATES:
+        counts = P_emit.get(state, {})
+        logs = log_emit.get(state, {})
+        for char in chars:
+            emit.append(logs.get(char, math.nan))
+            emit_counts.append(counts.get(char, 0))
+
+    sections = [
+        ('hmm_chars', array('I', (ord(char) for char in chars)).tobytes()),
+        ('hmm_emit', emit.tobytes()),
+        ('hmm_emit_counts', emit_counts.tobytes()),
+    ]
+    return sections, {'P_trans': P_trans,
+                      'P_trans_log': log_prob_table(P_trans)}
+
+
+def parse_hmm_sections(data, P_trans, P_trans_log):
+    """
+    由 hmm_sections 写入的各节还原出HMM模型 对数概率表直接读取 不必再计算
+    :param data: {节名: bytes}
+    :param P_trans: 原始转移计数
+    :param P_trans_log: 对数转移概率
+    :return: {'model_data': 原始计数, 'P_emit': 对数发射概率, 'P_trans': 对数转移概率}
+    """
+    # 直接按类型解读各节的字节 不再复制成数组
+    chars = [chr(code) for code in memoryview(data['hmm_chars']).cast('I')]
+    emit = memoryview(data['hmm_emit']).cast('d')
+    emit_counts = memoryview(data['hmm_emit_counts']).cast('Q')
+
+    n = len(chars)
+    P_emit = {}
+    P_emit_counts = {}
+    for i, state in enumerate(HMM_STATES):
+        logs = emit[i * n:(i + 1) * n]
+        counts = emit_counts[i * n:(i + 1) * n]
+        # nan 为没有这个字
+        P_emit[state] = {char: value for char, value in zip(chars, logs) if
+                         value == value}
+        state_counts = {char: count for char, count in zip(chars, counts) if
+                        count}
+        # 原来就没有的状态也不补上 保持原始计数不变
+        if state_counts:
+            P_emit_counts[state] = state_counts
+
+    return {'model_data': {'P_emit': P_emit_counts, 'P_trans': P_trans},
+            'P_emit': P_emit,
+            'P_trans': P_trans_log}
+
+
+def write_model(filename, word_fd, hmm_model_data, meta=None):
+    """
+    写二进制模型文件 先写临时文件再改名
+    :param filename:
+    :param word_fd: 词典
+    :param hmm_model_data: {'P_emit': 原始发射计数, 'P_trans': 原始转移计数}
+    :param meta: 额外记录的信息
+    :return:
+    """
+    if sys.byteorder != 'little':
+        raise Exception('binary model file only support little endian.')
+
+    encoded = sorted((word.encode('utf8'), freq) for word, freq in
+                     word_fd.items())
+
+    hmm, hmm_meta = hmm_sections(hmm_model_data)
+
+    meta = dict(meta or {})
+    meta.update({
+        'kind': 'model',
+        'total': sum(freq for key, freq in encoded),
+        'n_words': len(encoded),
+    })
+    meta.update(hmm_meta)
+
+    # 词语偏移要用到 words 节在文件中的绝对位置 等各节位置确定之后再生成
+    def gen_offsets(positions):
+        offsets = array('I', [positions['words']])
+        for key, freq in encoded:
+            offsets.append(offsets[-1] + len(key))
+        return offsets.tobytes()
+
+    words = b''.join(key for key, freq in encoded)
+    prefixes = [prefix for prefix, freq in gen_prefix_dict(word_fd).items()
+                if prefix not in word_fd]
+    sections = [
+        ('meta', json.dumps(meta, ensure_ascii=False).encode('utf8')),
+        ('words', words),
+        ('word_offsets', ((len(encoded) + 1) * array('I').itemsize,
+                          gen_offsets)),
+        ('word_freqs', array('q', (freq for key, freq in encoded)).tobytes()),
+        ('word_logfreqs', array('d', (math.log(freq) if freq > 0 else 0.0
+                                      for key, freq in encoded)).tobytes()),
+        ('word_prefixes', SEP.join(prefixes).encode('utf8')),
+        ('word_hash', build_hash_table(key for key, freq in encoded).tobytes()),
+    ] + hmm
+
+    write_sections(filename, sections)
+
+
+def write_sections(filename, sections):
+    """
+    写分节的二进制文件 先写临时文件再改名
+    :param filename:
+    :param sections: [(name, data)] data为bytes 或者 (长度, 函数)
+    函数接收各节位置 {name: offset} 返回该节的bytes
+    :return:
+    """
+    layout = []
+    pos = _align(HEADER.size + SECTION.size * len(sections))
+    for name, data in sections:
+        length = data[0] if isinstance(data, tuple) else len(data)
+        layout.append((name, pos, length))
+        pos = _align(pos + length)
+
+    positions = {name: offset for name, offset, length in layout}
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fp = tempfile.NamedTemporaryFile(mode='wb', dir=dirname, delete=False)
+    try:
+        fp.write(HEADER.pack(MAGIC, SCHEMA_VERSION, len(sections), 0))
+        for name, offset, length in layout:
+            fp.write(SECTION.pack(name.encode('ascii'), offset, length))
+        for (name, data), (_, offset, length) in zip(sections, layout):
+            if isinstance(data, tuple):
+                data = data[1](positions)
+            fp.write(b'\0' * (offset - fp.tell()))
+            fp.write(data)
+        fp.close()
+        # 临时文件只有自己可读写 改为和普通新建文件一样的权限
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(fp.name, 0o666 & ~umask)
+    except Exception:
+        fp.close()
+        os.remove(fp.name)
+        raise
+    shutil.move(fp.name, filename)
+
+
+def parse_header(buf, filename=''):
+    """
+    解析文件头 返回各节位置 {name: (offset, length)}
+    不是本格式的文件或者格式版本不对都会抛出 BinaryFormatError
+    """
+    if len(buf) < HEADER.size:
+        raise BinaryFormatError(f'{filename} is not a fenci binary file.')
+    magic, schema, n_sections, _ = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise BinaryFormatError(f'{filename} is not a fenci binary file.')
+    if schema != SCHEMA_VERSION:
+        raise BinaryFormatError(
+            f'unsupported binary file schema version {schema}.')
+    if len(buf) < HEADER.size + SECTION.size * n_sections:
+        raise BinaryFormatError(f'{filename} is truncated.')
+
+    sections = {}
+    for i in range(n_sections):
+        name, offset, length = SECTION.unpack_from(
+            buf, HEADER.size + SECTION.size * i)
+        sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+    return sections
+
+
+def read_sections(filename, names=None):
+    """
+    只读取需要的节
+    :param filename:
+    :param names: 需要的节 None为全部 文件里没有的节不返回
+    :return: {name: bytes}
+    """
+    with open(filename, 'rb') as f:
+        head = f.read(HEADER.size)
+        if len(head) == HEADER.size:
+            n_sections = HEADER.unpack_from(head, 0)[2] if head.startswith(
+                MAGIC) else 0
+            head += f.read(SECTION.size * n_sections)
+        sections = parse_header(head, filename)
+
+        result = {}
+        for name, (offset, length) in sections.items():
+            if names is None or name in names:
+                f.seek(offset)
+                result[name] = f.read(length)
+        return result
+
+
+class MappedModel(object):
+    """
+    mmap只读映射的二进制模型文件 pickle时只传递文件路径
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+
+        with open(self.filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.sections = parse_header(self._mmap, self.filename)
+
+        self.meta = json.loads(self.section_bytes('meta').decode('utf8'))
+
+        self._word_fd = None
+        self._dict_model = None
+        self._P_emit = None
+
+    def __reduce__(self):
+        return open_mapped_model, (self.filename,)
+
+    def section_bytes(self, name):
+        offset, length = self.sections[name]
+        return self._mmap[offset:offset + length]
+
+    def section_array(self, name, typecode):
+        offset, length = self.sections[name]
+        return memoryview(self._mmap)[offset:offset + length].cast(typecode)
+
+    @property
+    def word_fd(self):
+        if self._word_fd is None:
+            self._word_fd = FrozenWordDict(
+                self._mmap,
+                self.section_array('word_offsets', 'I'),
+                self.section_array('word_freqs', 'q'),
+                self.section_array('word_logfreqs', 'd'),
+                total=self.meta['total'],
+                owner=self,
+                hash_table=self.section_array('word_hash', 'Q')
+                if 'word_hash' in self.sections else None)
+        return self._word_fd
+
+    @property
+    def dict_model(self):
+        if self._dict_model is None:
+            self._dict_model = DictModel(self.word_fd)
+        return self._dict_model
+
+    @property
+    def hmm_chars(self):
+        return self.section_array('hmm_chars', 'I')
+
+    @property
+    def P_emit(self):
+        if self._P_emit is None:
+            self._P_emit = {state: MappedEmit(self, state) for state in
+                            HMM_STATES}
+        return self._P_emit
+
+    @property
+    def P_trans(self):
+        return self.meta['P_trans_log']
+
+    @property
+    def model_data(self):
+        return MappedModelData(self)
+
+    def emit_counts(self):
+        """
+        还原原始发射计数字典 只在继续训练或者导出时用到
+        """
+        chars = self.hmm_chars
+        counts = self.section_array('hmm_emit_counts', 'Q')
+        n = len(chars)
+        P_emit = {}
+        for i, state in enumerate(HMM_STATES):
+            P_emit[state] = {chr(chars[j]): counts[i * n + j] for j in
+                             range(n) if counts[i * n + j]}
+        return P_emit
+
+
+class MappedEmit(object):
+    """
+    某一状态的发射概率 顶替 P_emit[state] 字典 只需要提供get和items方法
+    """
+
+    def __init__(self, owner, state):
+        self.owner = owner
+        self.state = state
+        self.chars = owner.hmm_chars
+        n = len(self.chars)
+        i = HMM_STATES.index(state)
+        self.emit = owner.section_array('hmm_emit', 'd')[i * n:(i + 1) * n]
+
+    def __reduce__(self):
+        return _mapped_emit, (self.owner, self.state)
+
+    def get(self, char, default=None):
+        code = ord(char)
+        j = bisect_left(self.chars, code)
+        if j < len(self.chars) and self.chars[j] == code:
+            value = self.emit[j]
+            if value == value:  # nan 为没有这个字
+                return value
+        return default
+
+    def items(self):
+        for code, value in zip(self.chars, self.emit):
+            if value == value:
+                yield chr(code), value
+
+
+def _mapped_emit(owner, state):
+    return owner.P_emit[state]
+
+
+class MappedModelData(Mapping):
+    """
+    原始计数 用到时才从模型文件还原
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __getitem__(self, key):
+        if key == 'P_emit':
+            return self.owner.emit_counts()
+        elif key == 'P_trans':
+            return self.owner.meta['P_trans']
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(['P_emit', 'P_trans'])
+
+    def __len__(self):
+        return 2
+
+
+def read_model_meta(filename):
+    """
+    只读取模型文件的 meta 节
+    :param filename:
+    :return: dict
+    """
+    return json.loads(read_sections(filename, ('meta',))['meta'].decode('utf8'))
+
+
+def load_dict_model(filename):
+    """
+    将二进制模型文件里的词典载入为普通的可以修改的词典模型 不必解析文本
+    :param filename:
+    :return: DictModel
+    """
+    data = read_sections(filename, ('words', 'word_offsets', 'word_freqs',
+                                    'word_logfreqs', 'word_prefixes'))
+
+    offsets = array('I')
+    offsets.frombytes(data['word_offsets'])
+    freqs = array('q')
+    freqs.frombytes(data['word_freqs'])
+    log_freqs = array('d')
+    log_freqs.frombytes(data['word_logfreqs'])
+
+    blob = data['words']
+    base = offsets[0]
+    words = [blob[start - base:end - base].decode('utf8') for start, end in
+             zip(offsets, offsets[1:])]
+
+    word_fd = FreqDist(dict(zip(words, freqs)))
+
+    if 'word_prefixes' in data:
+        prefixes = data['word_prefixes'].decode('utf8')
+        prefix_dict = dict.fromkeys(prefixes.split(SEP) if prefixes else [],
+                                    0)
+        prefix_dict.update(word_fd)
+    else:
+        prefix_dict = None
+
+    log_freq = {word: log_freq for word, freq, log_freq in
+                zip(words, freqs, log_freqs) if freq > 0}
+
+    return DictModel(word_fd, prefix_dict=prefix_dict, log_freq=log_freq)
+
+
+def load_hmm_model(filename):
+    """
+    将二进制模型文件里的HMM模型载入为普通的字典 对数概率表直接读取 不必再计算
+    :param filename:
+    :return: {'model_data': 原始计数, 'P_emit': 对数发射概率, 'P_trans': 对数转移概率}
+    """
+    data = read_sections(filename, ('meta',) + HMM_SECTION_NAMES)
+    meta = json.loads(data['meta'].decode('utf8'))
+    return parse_hmm_sections(data, meta['P_trans'], meta['P_trans_log'])
+
+
+def open_mapped_model(filename):
+    """
+    同一个进程里同一个模型文件只映射一次
+    """
+    filename = os.path.abspath(filename)
+    return get_shared_model(('mapped', filename),
+                            lambda: MappedModel(filename))
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+模型缓存
+
+采用 binary_model 的分节二进制格式，meta节记录缓存格式版本、各部分的保存时间
+以及词典来源文件的 mtime 和 sha1。词典和HMM模型各自只读取自己需要的节。
+HMM模型和二进制模型文件一样同时保存原始计数和对数概率表，载入时不必重新计算。
+
+缓存文件名由来源文件（词典 HMM模型）的路径和内容的hash生成，不同的词典各自一份缓存，
+互不覆盖。缓存目录可以通过环境变量 FENCI_CACHE_DIR 设置，总大小超过上限时
+删除最久没用的缓存。
+需要查看缓存内容时可以用 export_cache_json 导出为原来的json格式。
+
+增量保存：词典和HMM模型的改动以json行的形式追加到缓存旁边的日志文件里，
+载入缓存时重放，保存的开销只和改动的大小有关。每条日志记录了它所基于的快照，
+快照重写之后旧的日志自动失效。日志太大时合并进快照。
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import tempfile
+import hashlib
+from array import array
+from collections.abc import Mapping
+
+from .nltk_utils import FreqDist
+from .model import DictModel, gen_prefix_dict
+from .binary_model import write_sections, read_sections, BinaryFormatError, \
+    hmm_sections, parse_hmm_sections, HMM_SECTION_NAMES
+from .utils import write_json
+from .const import CACHE_DIR_ENV, CACHE_MAX_BYTES_ENV, \
+    DEFAULT_CACHE_MAX_BYTES
+from . import __softname__
+
+CACHE_SCHEMA = 2
+
+DICT_SECTIONS = ('dict_words', 'dict_freqs', 'dict_logfreqs',
+                 'dict_prefixes')
+
+SEP = '\0'
+
+# 日志超过缓存文件大小的这个比例（并且超过最小字节数）时合并进快照
+JOURNAL_COMPACT_RATIO = 0.25
+JOURNAL_COMPACT_MIN_BYTES = 1 << 20
+
+
+# 已经算过的sha1 文件的 mtime 和大小都没变时直接复用
+_sha1_memo = {}
+
+
+def file_sha1(filename):
+    """
+    文件内容的sha1 同一个文件没有改动时只计算一次
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+    if key in _sha1_memo:
+        return _sha1_memo[key]
+
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    _sha1_memo[key] = h.hexdigest()
+    return _sha1_memo[key]
+
+
+def file_signature(filename):
+    """
+    记录来源文件的路径 mtime 大小 和 sha1
+    """
+    st = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'mtime': st.st_mtime,
+            'size': st.st_size, 'sha1': file_sha1(filename)}
+
+
+def get_cache_dir():
+    return os.environ.get(CACHE_DIR_ENV) or tempfile.gettempdir()
+
+
+def get_cache_max_bytes():
+    value = os.environ.get(CACHE_MAX_BYTES_ENV)
+    return int(value) if value else DEFAULT_CACHE_MAX_BYTES
+
+
+def cache_name(*sources):
+    """
+    根据来源文件的路径和内容生成缓存文件名 来源一样共用一份缓存 来源不同互不影响
+    :param sources: 来源文件 比如词典文件和HMM模型文件
+    :return:
+    """
+    h = hashlib.sha1(f'{CACHE_SCHEMA}'.encode('ascii'))
+    for filename in sources:
+        h.update(os.path.abspath(filename).encode('utf8'))
+        h.update(b'\0')
+        h.update(file_sha1(filename).encode('ascii'))
+        h.update(b'\0')
+    return f'{__softname__}-{h.hexdigest()[:16]}.cache'
+
+
+def touch_cache(cache_file):
+    """
+    记录缓存最近一次使用的时间 淘汰时据此判断
+    """
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+
+
+def evict_caches(cache_dir, max_bytes=None, keep=()):
+    """
+    缓存目录里所有缓存连同日志的总大小超过上限时 删除最久没用的缓存
+    :param cache_dir:
+    :param max_bytes: 大小上限 不给则用 get_cache_max_bytes
+    :param keep: 不能删除的缓存文件
+    :return: 删除的缓存文件
+    """
+    if max_bytes is None:
+        max_bytes = get_cache_max_bytes()
+    keep = {os.path.abspath(filename) for filename in keep}
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not (name.startswith(f'{__softname__}-') and
+                name.endswith('.cache')):
+            continue
+        filename = os.path.join(cache_dir, name)
+        files = [filename, journal_file(filename, 'dict'),
+                 journal_file(filename, 'hmm')]
+        try:
+            mtime = os.path.getmtime(filename)
+            size = sum(os.path.getsize(f) for f in files if
+                       os.path.isfile(f))
+        except OSError:
+            continue
+        entries.append((mtime, filename, files, size))
+
+    total = sum(entry[3] for entry in entries)
+    removed = []
+    for mtime, filename, files, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(filename) in keep:
+            continue
+        for f in files:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+        total -= size
+        removed.append(filename)
+    return removed
+
+
+def read_cache_meta(cache_file):
+    """
+    读取缓存的meta 没有缓存 不是二进制缓存（比如旧版本的json缓存）或者缓存格式版本不对都返回None
+    """
+    if not os.path.isfile(cache_file):
+        return None
+
+    try:
+        meta = read_sections(cache_file, ('meta',)).get('meta')
+    except BinaryFormatError:
+        return None
+
+    if meta is None:
+        return None
+
+    meta = json.loads(meta.decode('utf8'))
+    if meta.get('kind') != 'cache' or meta.get(
+            'cache_schema') != CACHE_SCHEMA:
+        return None
+    return meta
+
+
+def update_cache(cache_file, sections, meta):
+    """
+    更新缓存中的某些节和meta 其他节原样保留
+    调用方负责加文件锁
+    :param cache_file:
+    :param sections: {name: bytes}
+    :param meta: 需要更新的meta
+    :return:
+    """
+    old_sections = {}
+    old_meta = read_cache_meta(cache_file)
+    if old_meta is not None:
+        old_sections = read_sections(cache_file)
+    else:
+        old_meta = {}
+
+    old_meta.update(meta)
+    old_meta.update({'kind': 'cache', 'cache_schema': CACHE_SCHEMA})
+
+    old_sections.update(sections)
+    old_sections['meta'] = json.dumps(old_meta, ensure_ascii=False).encode(
+        'utf8')
+
+    write_sections(cache_file, sorted(old_sections.items()))
+
+    evict_caches(os.path.dirname(os.path.abspath(cache_file)),
+                 keep=(cache_file,))
+
+
+def save_dict_cache(cache_file, word_fd, prefix_dict=None, source=None):
+    """
+    保存词典 连同前缀词典里那些不是词语的前缀和对数词频 载入时不必重新计算
+    """
+    words = list(word_fd)
+    if any(SEP in word for word in words):
+        raise Exception('word in dictionary can not contain NUL character.')
+
+    if not isinstance(prefix_dict, Mapping):
+        prefix_dict = gen_prefix_dict(word_fd)
+    prefixes = [prefix for prefix, freq in prefix_dict.items() if
+                prefix not in word_fd]
+
+    freqs = array('q', (word_fd[word] for word in words))
+    log_freqs = array('d', (math.log(freq) if freq > 0 else 0.0
+                            for freq in freqs))
+
+    update_cache(cache_file, {
+        'dict_words': SEP.join(words).encode('utf8'),
+        'dict_freqs': freqs.tobytes(),
+        'dict_logfreqs': log_freqs.tobytes(),
+        'dict_prefixes': SEP.join(prefixes).encode('utf8'),
+    }, {
+        'word_fd_timestamp': int(time.time()),
+        'dict_source': source,
+        'dict_snapshot': uuid.uuid4().hex,
+    })
+    clear_journal(cache_file, 'dict')
+
+
+def _split(data):
+    text = data.decode('utf8')
+    return text.split(SEP) if text else []
+
+
+def load_dict_cache(cache_file):
+    data = read_sections(cache_file, DICT_SECTIONS)
+    touch_cache(cache_file)
+
+    words = _split(data['dict_words'])
+    freqs = array('q')
+    freqs.frombytes(data['dict_freqs'])
+    log_freqs = array('d')
+    log_freqs.frombytes(data['dict_logfreqs'])
+
+    word_fd = FreqDist(dict(zip(words, freqs)))
+
+    prefix_dict = dict.fromkeys(_split(data['dict_prefixes']), 0)
+    prefix_dict.update(word_fd)
+
+    log_freq = {word: log_freq for word, freq, log_freq in
+                zip(words, freqs, log_freqs) if freq > 0}
+
+    return DictModel(word_fd, prefix_dict=prefix_dict, log_freq=log_freq)
+
+
+def save_hmm_cache(cache_file, model_data):
+    """
+    保存HMM模型的原始计数 连同算好的对数概率表
+    """
+    sections, hmm_meta = hmm_sections(model_data)
+    update_cache(cache_file, dict(sections), {
+        'hmm_timestamp': int(time.time()),
+        'hmm_snapshot': uuid.uuid4().hex,
+        'hmm_P_trans': hmm_meta['P_trans'],
+        'hmm_P_trans_log': hmm_meta['P_trans_log'],
+    })
+    clear_journal(cache_file, 'hmm')
+
+
+def load_hmm_cache_model(cache_file):
+    """
+    :return: {'model_data': 原始计数, 'P_emit': 对数发射概率, 'P_trans': 对数转移概率}
+    """
+    data = read_sections(cache_file, ('meta',) + HMM_SECTION_NAMES)
+    touch_cache(cache_file)
+    meta = json.loads(data['meta'].decode('utf8'))
+    return parse_hmm_sections(data, meta['hmm_P_trans'],
+                              meta['hmm_P_trans_log'])
+
+
+def load_hmm_cache(cache_file):
+    """
+    只要原始计数
+    """
+    return load_hmm_cache_model(cache_file)['model_data']
+
+
+def export_cache_json(cache_file, json_file):
+    """
+    将缓存导出为json 方便查看 只导出快照 日志里的改动需要先合并
+    """
+    meta = read_cache_meta(cache_file)
+    if meta is None:
+        raise Exception(f'{cache_file} is not a valid cache file.')
+
+    data = {}
+    if meta.get('word_fd_timestamp'):
+        data['word_fd'] = dict(load_dict_cache(cache_file).word_fd)
+        data['word_fd_timestamp'] = meta['word_fd_timestamp']
+    if meta.get('hmm_timestamp'):
+        data.update(load_hmm_cache(cache_file))
+        data['hmm_timestamp'] = meta['hmm_timestamp']
+
+    write_json(json_file, data)
+
+
+def journal_file(cache_file, kind):
+    return f'{cache_file}.{kind}.journal'
+
+
+def append_journal(cache_file, kind, records):
+    """
+    追加日志 调用方负责加文件锁
+    :param cache_file:
+    :param kind: dict 或者 hmm
+    :param records: [dict]
+    :return: 缓存里还没有这部分的快照时返回False 此时应该整体保存
+    """
+    meta = read_cache_meta(cache_file)
+    base = meta.get(f'{kind}_snapshot') if meta is not None else None
+    if base is None:
+        return False
+
+    lines = [json.dumps(dict(record, base=base), ensure_ascii=False,
+                        separators=(',', ':')) + '\n' for record in records]
+    with open(journal_file(cache_file, kind), 'a', encoding='utf8') as f:
+        f.write(''.join(lines))
+    return True
+
+
+def read_journal(cache_file, kind, base):
+    """
+    读取基于快照 base 的日志 其他快照的日志以及写了一半的行都跳过
+    """
+    filename = journal_file(cache_file, kind)
+    if base is None or not os.path.isfile(filename):
+        return []
+
+    records = []
+    with open(filename, 'rt', encoding='utf8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('base') == base:
+                records.append(record)
+    return records
+
+
+def clear_journal(cache_file, kind):
+    filename = journal_file(cache_file, kind)
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+
+def journal_exists(cache_file, kind):
+    return os.path.isfile(journal_file(cache_file, kind))
+
+
+def journal_needs_compact(cache_file, kind):
+    if not journal_exists(cache_file, kind):
+        return False
+    size = os.path.getsize(journal_file(cache_file, kind))
+    return size > max(JOURNAL_COMPACT_MIN_BYTES,
+                      os.path.getsize(cache_file) * JOURNAL_COMPACT_RATIO)
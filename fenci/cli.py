@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+命令行工具
+
+    fenci compile [dictionary] -o output.model [--hmm hmm_data.json]
+
+将词典和HMM模型编译为二进制模型文件，用 Segment(model_file=...) 直接载入。
+不给词典和HMM模型则编译默认的，打包时安装包里的 default.model 就是这样生成的。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from . import __softname__, __version__
+from .binary_model import write_model
+from .cache import file_sha1
+from .const import DEFAULT_DICT, DEFAULT_HMM_DATA
+from .utils import get_resource_path
+
+
+def compile_model(output, dictionary=None, hmm_data=None):
+    """
+    编译二进制模型文件
+    :param output: 输出文件
+    :param dictionary: 词典文件 每行 词语 词频 不给则用默认词典
+    :param hmm_data: HMM模型json文件 不给则用默认HMM模型
+    :return:
+    """
+    from .segment import read_dict_file
+
+    if dictionary is None:
+        dictionary = get_resource_path(__softname__, DEFAULT_DICT)
+    if hmm_data is None:
+        hmm_data = get_resource_path(__softname__, DEFAULT_HMM_DATA)
+
+    try:
+        word_fd = read_dict_file(dictionary)
+    except ValueError:
+        raise ValueError(f'{dictionary} is not a dictionary file, each line '
+                         f'should be "word freq".') from None
+    with open(hmm_data, encoding='utf8') as f:
+        model_data = json.load(f)
+    if not isinstance(model_data, dict) or 'P_emit' not in model_data or \
+            'P_trans' not in model_data:
+        raise ValueError(f'{hmm_data} is not a HMM model json file.')
+
+    write_model(output, word_fd,
+                {'P_emit': model_data['P_emit'],
+                 'P_trans': model_data['P_trans']},
+                meta={'dictionary': os.path.basename(dictionary),
+                      'dictionary_sha1': file_sha1(dictionary),
+                      'hmm_data': os.path.basename(hmm_data),
+                      'hmm_data_sha1': file_sha1(hmm_data)})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog=__softname__,
+                                     description='中文分词')
+    parser.add_argument('--version', action='version',
+                        version=f'{__softname__} {__version__}')
+    subparsers = parser.add_subparsers(dest='command')
+
+    compile_parser = subparsers.add_parser(
+        'compile', help='compile a dictionary into a binary model file')
+    compile_parser.add_argument('dictionary', nargs='?',
+                                help='dictionary file, one "word freq" '
+                                     'per line, default is the builtin one')
+    compile_parser.add_argument('-o', '--output', required=True,
+                                help='output model file')
+    compile_parser.add_argument('--hmm', dest='hmm_data',
+                                help='HMM model json file, default is the '
+                                     'builtin one')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compile':
+        for filename in (args.dictionary, args.hmm_data):
+            if filename is not None and not os.path.isfile(filename):
+                compile_parser.error(f'no such file: {filename}')
+
+        t1 = time.time()
+        try:
+            compile_model(args.output, args.dictionary, args.hmm_data)
+        except (OSError, ValueError) as e:
+            compile_parser.error(str(e))
+        print(f'compiled {args.output} in {time.time() - t1:.2f} seconds.')
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,10 +2,19 @@
 # -*-coding:utf-8-*-
 
 
-from . import __softname__
-
 DEFAULT_DICT = 'dict_small.txt'
 
 DEFAULT_HMM_DATA = 'hmm_data.json'
 
-DEFALUT_CACHE_NAME = f'{__softname__}.cache'
\ No newline at end of file
+# 已弃用 缓存文件名现在由词典和HMM模型的路径和内容决定 见 cache.cache_name
+DEFALUT_CACHE_NAME = 'fenci.cache'
+
+# 由默认词典和默认HMM模型预先编译好的二进制模型 用 fenci compile 生成
+DEFAULT_MODEL = 'default.model'
+
+# 缓存目录 默认为系统临时目录
+CACHE_DIR_ENV = 'FENCI_CACHE_DIR'
+
+# 缓存目录里所有缓存的大小上限 超过时删除最久没用的缓存
+CACHE_MAX_BYTES_ENV = 'FENCI_CACHE_MAX_BYTES'
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
\ No newline at end of file
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+紧凑的只读词典
+
+所有词语按utf8字节序排好拼接成一个bytes，配合偏移数组和词频数组，
+相比FreqDist每个词一个str对象一个int对象，内存占用要小得多。
+utf8字节序和unicode码点顺序一致，所以二分查找既能判断是否是词语，
+也能判断是否是某个词语的前缀。
+二进制模型文件里另有一个散列表，词语和前缀都只需查找一次，比二分查找快得多。
+"""
+
+import sys
+import math
+from array import array
+from zlib import crc32
+from collections.abc import Mapping
+
+
+def build_hash_table(words):
+    """
+    开放寻址的散列表 键为词语以及词语的前缀的utf8编码
+    每个槽位为 (键的字节数 << 32) | (词语序号 + 1) 空槽为0
+    键只是前缀时记录第一个以它开头的词语 键就是这个词语的开头几个字节 不必另外存放
+    :param words: 排好序的词语utf8编码
+    :return: array('Q')
+    """
+    keys = {}
+    for i, word in enumerate(words):
+        text = word.decode('utf8')
+        # 排在前面的词语都比它小 不会以它开头 所以词语本身记录的一定是它自己
+        for j in range(1, len(text) + 1):
+            keys.setdefault(text[:j].encode('utf8'), i)
+
+    # 装载率不超过 3/4
+    size = 8
+    while size * 3 < len(keys) * 4:
+        size <<= 1
+    mask = size - 1
+
+    table = array('Q', bytes(size * array('Q').itemsize))
+    for key, i in keys.items():
+        slot = crc32(key) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = (len(key) << 32) | (i + 1)
+    return table
+
+
+class FrozenWordDict(Mapping):
+    def __init__(self, blob, offsets, freqs, log_freqs=None, total=None,
+                 owner=None, hash_table=None):
+        """
+        :param blob: 排好序的词语utf8编码拼接而成 也可以是mmap
+        :param offsets: 第i个词语为 blob[offsets[i]:offsets[i + 1]]
+        :param freqs: 第i个词语的词频
+        :param log_freqs: 第i个词语的对数词频 不给则根据freqs计算
+        :param total: 总词频 不给则根据freqs计算
+        :param owner: 数据来自映射的模型文件时 pickle只传递对它的引用
+        :param hash_table: build_hash_table 生成的散列表 不给则二分查找
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.freqs = freqs
+
+        if log_freqs is None:
+            log_freqs = array('d', (math.log(freq) if freq > 0 else 0.0
+                                    for freq in freqs))
+        self.log_freqs = log_freqs
+
+        self._N = total if total is not None else sum(freqs)
+        self.owner = owner
+        self.hash_table = hash_table
+
+    def __reduce__(self):
+        if self.owner is not None:
+            return getattr, (self.owner, 'word_fd')
+        return FrozenWordDict, (self.blob, self.offsets, self.freqs,
+                                self.log_freqs, self._N)
+
+    @classmethod
+    def from_freq_dist(cls, word_fd):
+        encoded = sorted((word.encode('utf8'), freq) for word, freq in
+                         word_fd.items())
+
+        offsets = array('I', [0])
+        freqs = array('q')
+        pos = 0
+        for key, freq in encoded:
+            pos += len(key)
+            offsets.append(pos)
+            freqs.append(freq)
+
+        blob = b''.join(key for key, freq in encoded)
+
+        return cls(blob, offsets, freqs)
+
+    def _bisect(self, key):
+        """
+        返回第一个不小于key的词语的序号
+        """
+        blob = self.blob
+        offsets = self.offsets
+        lo, hi = 0, len(self.freqs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blob[offsets[mid]:offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _lookup(self, key):
+        """
+        在散列表里查找
+        :param key: utf8编码
+        :return: (词语序号, key是否就是这个词语) 不是词语也不是前缀时序号为-1
+        """
+        blob = self.blob
+        offsets = self.offsets
+        table = self.hash_table
+        mask = len(table) - 1
+        n = len(key)
+
+        slot = crc32(key) & mask
+        while True:
+            value = table[slot]
+            if not value:
+                return -1, False
+            if value >> 32 == n:
+                i = (value & 0xFFFFFFFF) - 1
+                start = offsets[i]
+                if blob[start:start + n] == key:
+                    return i, offsets[i + 1] - start == n
+            slot = (slot + 1) & mask
+
+    def index(self, word):
+        key = word.encode('utf8')
+        if self.hash_table is not None:
+            i, is_word = self._lookup(key)
+            return i if is_word else -1
+
+        i = self._bisect(key)
+        if i < len(self.freqs) and \
+                self.blob[self.offsets[i]:self.offsets[i + 1]] == key:
+            return i
+        return -1
+
+    def prefix_get(self, frag):
+        """
+        和前缀词典一样的语义 是词语返回词频 只是某个词语的前缀返回0 否则返回None
+        """
+        key = frag.encode('utf8')
+        if self.hash_table is not None:
+            i, is_word = self._lookup(key)
+            if i < 0:
+                return None
+            return self.freqs[i] if is_word else 0
+
+        i = self._bisect(key)
+        if i < len(self.freqs):
+            found = self.blob[self.offsets[i]:self.offsets[i + 1]]
+            if found == key:
+                return self.freqs[i]
+            if found.startswith(key):
+                return 0
+        return None
+
+    def log_freq_get(self, word, default=None):
+        i = self.index(word)
+        if i < 0 or self.freqs[i] <= 0:
+            return default
+        return self.log_freqs[i]
+
+    def get(self, word, default=None):
+        i = self.index(word)
+        if i < 0:
+            return default
+        return self.freqs[i]
+
+    def __getitem__(self, word):
+        i = self.index(word)
+        if i < 0:
+            raise KeyError(word)
+        return self.freqs[i]
+
+    def __contains__(self, word):
+        return self.index(word) >= 0
+
+    def __iter__(self):
+        blob = self.blob
+        offsets = self.offsets
+        for i in range(len(self.freqs)):
+            yield bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf8')
+
+    def __len__(self):
+        return len(self.freqs)
+
+    def N(self):
+        return self._N
+
+    @property
+    def nbytes(self):
+        nbytes = (self.offsets[-1] - self.offsets[0] +
+                  len(self.offsets) * self.offsets.itemsize +
+                  len(self.freqs) * self.freqs.itemsize +
+                  len(self.log_freqs) * self.log_freqs.itemsize)
+        if self.hash_table is not None:
+            nbytes += len(self.hash_table) * self.hash_table.itemsize
+        return nbytes
+
+    @property
+    def prefix_view(self):
+        return _FrozenView(self.prefix_get)
+
+    @property
+    def log_freq_view(self):
+        return _FrozenView(self.log_freq_get)
+
+
+class _FrozenView(object):
+    """
+    让 FrozenWordDict 能够顶替 prefix_dict 和 log_freq 两个字典 只需要提供get方法
+    """
+
+    def __init__(self, get):
+        self.get = get
+
+
+def get_dict_nbytes(*dicts):
+    """
+    估算若干字典连同其键值对象的内存占用 多个字典共用的对象只计算一次
+    """
+    seen = set()
+    total = 0
+    for d in dicts:
+        total += sys.getsizeof(d)
+        for k, v in d.items():
+            for obj in (k, v):
+                if id(obj) not in seen:
+                    seen.add(id(obj))
+                    total += sys.getsizeof(obj)
+    return total
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+numpy 实现的viterbi
+
+发射概率为 (4, 字数+1) 的数组 最后一列是没见过的字，转移概率为 4x4 的数组，
+逐字做向量化的 max/argmax 并记录回溯指针，最后再回溯出路径。
+计算顺序和比较规则都和 hmm_segment.viterbi 一样，结果完全相同。
+
+只有4个状态，单个句子逐字计算时numpy每一步的调用开销抵消了向量化的好处，
+batch 把同样长度的句子叠在一起同时计算，每一步处理一整组句子。
+
+numpy 是可选的依赖，没有安装时 available() 返回False。
+"""
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+MIN_FLOAT = -3.14e100
+
+# 原实现用 max 比较 (概率, 状态) 元组 概率相同时取字母大的状态
+# 这里状态按字母倒序排列 argmax 取第一个最大值 效果相同
+STATES = 'SMEB'
+
+PrevStatus = {
+    'B': 'ES',
+    'M': 'MB',
+    'S': 'SE',
+    'E': 'BM'
+}
+
+
+def available():
+    return np is not None
+
+
+class NumpyViterbi(object):
+    def __init__(self, start_p, trans_p, emit_p):
+        """
+        :param start_p: 初始状态对数概率
+        :param trans_p: 对数转移概率 {状态: {状态: 概率}}
+        :param emit_p: 对数发射概率 {状态: {字: 概率}} 或者提供 items 方法的对象
+        """
+        if np is None:
+            raise Exception('numpy is not installed.')
+
+        self.start = np.array([start_p[y] for y in STATES])
+
+        # 不在 PrevStatus 里的转移不参与比较
+        self.trans = np.full((4, 4), -np.inf)
+        for i, y0 in enumerate(STATES):
+            for j, y in enumerate(STATES):
+                if y0 in PrevStatus[y]:
+                    self.trans[i, j] = trans_p[y0].get(y, MIN_FLOAT)
+
+        chars = {}
+        items = {y: list(emit_p[y].items()) for y in STATES}
+        for y in STATES:
+            for char, prob in items[y]:
+                chars.setdefault(char, len(chars))
+        self.char_index = chars
+
+        self.emit = np.full((4, len(chars) + 1), MIN_FLOAT)
+        for i, y in enumerate(STATES):
+            for char, prob in items[y]:
+                self.emit[i, chars[char]] = prob
+
+    def _char_ids(self, obs):
+        unknown = len(self.char_index)
+        index_get = self.char_index.get
+        return [index_get(char, unknown) for char in obs]
+
+    def __call__(self, obs):
+        """
+        :param obs: 句子
+        :return: (概率, 状态列表) 和 hmm_segment.viterbi 一样
+        """
+        n = len(obs)
+        ids = np.array(self._char_ids(obs), dtype=np.intp)
+        em = self.emit[:, ids].T  # (n, 4)
+
+        trans = self.trans
+        cols = np.arange(4)
+        back = np.empty((n, 4), dtype=np.intp)
+
+        V = self.start + em[0]
+        for t in range(1, n):
+            # 和原实现一样的加法顺序 V + trans + em
+            scores = V[:, None] + trans + em[t]
+            bp = scores.argmax(axis=0)
+            V = scores[bp, cols]
+            back[t] = bp
+
+        # 最后一个字只能是 E 或者 S 相同时取 S
+        s, e = STATES.index('S'), STATES.index('E')
+        state = s if V[s] >= V[e] else e
+        prob = float(V[state])
+
+        path = [state]
+        for t in range(n - 1, 0, -1):
+            state = back[t, state]
+            path.append(state)
+        path.reverse()
+
+        return prob, [STATES[i] for i in path]
+
+    def batch(self, obs_list):
+        """
+        批量计算 同样长度的句子一起算
+        :param obs_list: 句子列表
+        :return: 和 obs_list 一一对应的 (概率, 状态列表)
+        """
+        groups = {}
+        for i, obs in enumerate(obs_list):
+            groups.setdefault(len(obs), []).append(i)
+
+        results = [None] * len(obs_list)
+        for n, indexes in groups.items():
+            if n == 0:
+                continue
+            if len(indexes) == 1:
+                results[indexes[0]] = self(obs_list[indexes[0]])
+                continue
+            for i, result in zip(indexes, self._batch_same_length(
+                    [obs_list[i] for i in indexes], n)):
+                results[i] = result
+        return results
+
+    def _batch_same_length(self, obs_list, n):
+        k = len(obs_list)
+        ids = np.array([self._char_ids(obs) for obs in obs_list],
+                       dtype=np.intp)  # (k, n)
+        em = self.emit[:, ids].transpose(2, 1, 0)  # (n, k, 4)
+
+        trans = self.trans
+        back = np.empty((n, k, 4), dtype=np.intp)
+        rows = np.arange(k)[:, None]
+        cols = np.arange(4)[None, :]
+
+        V = self.start + em[0]  # (k, 4)
+        for t in range(1, n):
+            scores = V[:, :, None] + trans + em[t][:, None, :]  # (k, 4, 4)
+            bp = scores.argmax(axis=1)
+            V = scores[rows, bp, cols]
+            back[t] = bp
+
+        s, e = STATES.index('S'), STATES.index('E')
+        state = np.where(V[:, s] >= V[:, e], s, e)
+        probs = V[np.arange(k), state]
+
+        paths = np.empty((n, k), dtype=np.intp)
+        paths[n - 1] = state
+        rows = np.arange(k)
+        for t in range(n - 1, 0, -1):
+            state = back[t, rows, state]
+            paths[t - 1] = state
+
+        return [(float(probs[j]), [STATES[i] for i in paths[:, j]]) for j in
+                range(k)]
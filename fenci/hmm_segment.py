@@ -4,18 +4,24 @@
 import time
 import re
 import os
-from copy import deepcopy
 import logging
 import threading
-from math import log
+from contextlib import contextmanager
 
 from filelock import FileLock
 
 from .base import BaseSegment
 from .nltk_utils import TokenizerI
-from .train_hmm import train_emit_matrix, train_trans_matrix
-from .utils import strdecode, get_json_value, update_json_file, get_resource_path
-from .const import DEFAULT_HMM_DATA
+from .train_hmm import count_training
+from .utils import strdecode, iter_offsets, get_json_data, get_resource_path
+from .const import DEFAULT_HMM_DATA, DEFAULT_MODEL
+from .model import get_shared_model
+from .binary_model import open_mapped_model, load_hmm_model, log_prob_table, \
+    read_model_meta, BinaryFormatError
+from .lru_cache import LRUCache, words_sizeof
+from .cache import read_cache_meta, load_hmm_cache, load_hmm_cache_model, \
+    save_hmm_cache, append_journal, read_journal, journal_exists, journal_needs_compact, \
+    cache_name, file_sha1
 from . import __softname__
 
 logger = logging.getLogger(__name__)
@@ -41,7 +47,18 @@ PrevStatus = {
 class HMMSegment(TokenizerI, BaseSegment):
     def __init__(self, traning_root=None,
                  traning_regexp='.*\.txt', traning_mode='update',
-                 cache_file=None):
+                 cache_file=None, model_file=None, cache_dir=None,
+                 viterbi_backend='python'):
+        """
+        :param traning_root:
+        :param traning_regexp:
+        :param traning_mode:
+        :param cache_file: 缓存文件名 不给则由HMM模型文件的路径和内容决定
+        :param model_file: 二进制模型文件 给了则直接mmap映射使用
+        :param cache_dir: 缓存目录 不给则用环境变量 FENCI_CACHE_DIR 或者系统临时目录
+        :param viterbi_backend: python 或者 numpy 两者结果完全相同 numpy需要另外安装
+        """
+        super().__init__()
         self.training_root = traning_root
         self.training_regexp = traning_regexp
 
@@ -49,20 +66,143 @@ class HMMSegment(TokenizerI, BaseSegment):
 
         assert self.training_mode in ['update', 'replace']
 
-        self.cache_file = cache_file
-        self.tmp_dir = None
-
-        self.P_trans = None
-        self.model_data = {}
-        self.P_emit = None
+        self.cache_file = cache_file if cache_file is not None else \
+            cache_name(self._get_default_model_file())
+        self.model_file = model_file
+        self.tmp_dir = cache_dir
+
+        # 原始计数和对数概率表放在一起 训练时整体替换 分词的线程不会看到一半新一半旧的模型
+        self.model = {'model_data': {}, 'P_emit': None, 'P_trans': None}
+        self.model_version = 0
+        # 上次保存之后的训练记录 增量保存时写入日志
+        self._journal = []
+
+        if viterbi_backend not in ('python', 'numpy'):
+            raise Exception(f'unknown viterbi backend {viterbi_backend}.')
+        if viterbi_backend == 'numpy':
+            # 用到时才导入 默认的python实现不必载入numpy
+            from . import hmm_numpy
+            if not hmm_numpy.available():
+                raise Exception('numpy is not installed.')
+        self.viterbi_backend = viterbi_backend
+        # (模型, 由该模型构建的 NumpyViterbi)
+        self._numpy_viterbi = None
+
+        self._cache = None
+        self._cache_version = None
+        self._cache_max_key_length = None
 
         self.initialized = False
 
+    def __getstate__(self):
+        """
+        numpy的数组可以由模型重建 不必pickle 缓存也不带到子进程
+        """
+        state = super().__getstate__()
+        state['_numpy_viterbi'] = None
+        state['_cache'] = None
+        return state
+
+    @property
+    def model_data(self):
+        return self.model['model_data']
+
+    @property
+    def P_emit(self):
+        return self.model['P_emit']
+
+    @property
+    def P_trans(self):
+        return self.model['P_trans']
+
     def __cut(self, sentence):
         self.check_initialized()
 
-        prob, pos_list = viterbi(sentence, 'BMES', start_P, self.P_trans,
-                                 self.P_emit)
+        if self._cache is not None:
+            return self._cut_blocks([sentence])[0]
+
+        model = self.model
+        if self.viterbi_backend == 'numpy':
+            prob, pos_list = self._get_numpy_viterbi(model)(sentence)
+        else:
+            prob, pos_list = viterbi(sentence, 'BMES', start_P,
+                                     model['P_trans'], model['P_emit'])
+        return self._path_words(sentence, pos_list)
+
+    def _decode_blocks(self, model, blocks):
+        if self.viterbi_backend == 'numpy':
+            paths = self._get_numpy_viterbi(model).batch(blocks)
+        else:
+            paths = [viterbi(blk, 'BMES', start_P, model['P_trans'],
+                             model['P_emit']) for blk in blocks]
+        return [tuple(self._path_words(blk, pos_list)) for
+                blk, (prob, pos_list) in zip(blocks, paths)]
+
+    def _cut_blocks(self, blocks):
+        """
+        对若干汉字块做viterbi 开启了缓存时先查缓存 没命中的再一起计算
+        :param blocks: 没有重复的汉字块
+        :return: 和 blocks 一一对应的词语元组
+        """
+        cache = self._cache
+        # 先取版本再取模型 训练换了模型之后 用旧模型算出的结果不会放进新版本的缓存
+        version = self.model_version
+        model = self.model
+        if cache is None:
+            return self._decode_blocks(model, blocks)
+
+        if version != self._cache_version:
+            cache.clear()
+            self._cache_version = version
+
+        max_key_length = self._cache_max_key_length
+        results = [None] * len(blocks)
+        missing = []
+        for i, blk in enumerate(blocks):
+            if len(blk) <= max_key_length:
+                results[i] = cache.get(blk)
+            if results[i] is None:
+                missing.append(i)
+
+        if missing:
+            decoded = self._decode_blocks(model,
+                                          [blocks[i] for i in missing])
+            keep = version == self._cache_version
+            for i, words in zip(missing, decoded):
+                results[i] = words
+                if keep and len(blocks[i]) <= max_key_length:
+                    cache.put(blocks[i], words)
+        return results
+
+    def enable_cache(self, max_size=10000, max_bytes=None,
+                     max_key_length=32):
+        """
+        缓存每个汉字块的viterbi结果 训练或者重新载入模型之后缓存自动清空
+        :param max_size: 最多缓存多少个块
+        :param max_bytes: 缓存大概最多占用多少字节
+        :param max_key_length: 超过这个长度的汉字块很少重复出现 不缓存
+        :return:
+        """
+        self.check_initialized()
+
+        self._cache = LRUCache(max_size=max_size, max_bytes=max_bytes,
+                               sizeof=words_sizeof)
+        self._cache_version = self.model_version
+        self._cache_max_key_length = max_key_length
+
+    def disable_cache(self):
+        self._cache = None
+
+    def cache_info(self):
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    @staticmethod
+    def _path_words(sentence, pos_list):
+        """
+        根据每个字的 BMES 状态切出词语
+        """
         begin, nexti = 0, 0
         # logger.debug pos_list, sentence
         for i, char in enumerate(sentence):
@@ -78,8 +218,30 @@ class HMMSegment(TokenizerI, BaseSegment):
         if nexti < len(sentence):
             yield sentence[nexti:]
 
-    def cut(self, sentence):
+    def _get_numpy_viterbi(self, model):
+        from . import hmm_numpy
+
+        cached = self._numpy_viterbi
+        if cached is None or cached[0] is not model:
+            cached = (model, hmm_numpy.NumpyViterbi(start_P, model['P_trans'],
+                                                    model['P_emit']))
+            self._numpy_viterbi = cached
+        return cached[1]
+
+    def cut(self, sentence, with_offsets=False):
+        """
+        HMM分词
+        :param sentence:
+        :param with_offsets: 为True时返回 (word, start, end)
+        :return:
+        """
         sentence = strdecode(sentence)
+        words = self._cut(sentence)
+        if with_offsets:
+            return iter_offsets(words)
+        return words
+
+    def _cut(self, sentence):
         blocks = re_han_hmm.split(sentence)
         for blk in blocks:
             if re_han_hmm.match(blk):
@@ -92,13 +254,99 @@ class HMMSegment(TokenizerI, BaseSegment):
                     if x:
                         yield x
 
-    def lcut(self, s):
-        return list(self.cut(s))
+    def lcut_many(self, sentences):
+        """
+        批量HMM分词 所有句子里的汉字块去重之后一起做viterbi
+        numpy 实现会把同样长度的汉字块叠在一起同时计算
+        :param sentences:
+        :return: 和 sentences 一一对应的分词结果
+        """
+        self.check_initialized()
+
+        # 汉字块在 blocks 里的序号 或者直接输出的非汉字片段
+        blocks = {}
+        items_list = []
+        for sentence in sentences:
+            items = []
+            for blk in re_han_hmm.split(strdecode(sentence)):
+                if re_han_hmm.match(blk):
+                    items.append(blocks.setdefault(blk, len(blocks)))
+                else:
+                    items.extend(x for x in re_skip_hmm.split(blk) if x)
+            items_list.append(items)
+
+        block_words = self._cut_blocks(list(blocks))
+
+        results = []
+        for items in items_list:
+            words = []
+            for item in items:
+                if isinstance(item, int):
+                    words.extend(block_words[item])
+                else:
+                    words.append(item)
+            results.append(words)
+        return results
+
+    def lcut(self, s, with_offsets=False):
+        return list(self.cut(s, with_offsets=with_offsets))
+
+    def span_tokenize(self, s):
+        for word, start, end in self.cut(s, with_offsets=True):
+            yield start, end
 
     def tokenize(self, s):
         return self.lcut(s)
 
-    def save_model(self):
+    def save_model(self, incremental=True):
+        """
+        保存模型
+        :param incremental: 为True时只把上次保存之后的训练记录追加到日志里
+        为False时整体重写缓存
+        :return:
+        """
+        cache_file = self._get_cache_file()
+        compact = False
+
+        with self._pending_journal() as (journal, model_data):
+            if incremental and not journal:
+                return
+
+            saved = False
+            if incremental:
+                with FileLock(f'{cache_file}.lock'):
+                    logger.debug(
+                        "Appending HMM model changes to journal {0}".format(
+                            cache_file))
+                    saved = append_journal(cache_file, 'hmm', journal)
+                    compact = saved and journal_needs_compact(cache_file,
+                                                              'hmm')
+
+            if not saved:
+                # 整体重写 或者缓存还没有快照
+                self._dump_model(model_data)
+
+        if compact:
+            self.compact_model()
+
+    @contextmanager
+    def _pending_journal(self):
+        """
+        在锁内取走还没保存的训练记录和与之对应的模型 换上一份空的记录
+        写文件期间其他线程的训练记在新的记录里 写文件出错则把取走的记录放回前面
+        """
+        with self._update_lock:
+            journal, self._journal = self._journal, []
+            model_data = self.model_data
+
+        try:
+            yield journal, model_data
+        except BaseException:
+            with self._update_lock:
+                self._journal[:0] = journal
+            raise
+
+    def _dump_model(self, model_data):
         cache_file = self._get_cache_file()
 
         wlock = FileLock(f'{cache_file}.lock')
@@ -106,39 +354,104 @@ class HMMSegment(TokenizerI, BaseSegment):
         with wlock:
             logger.debug(
                 "Dumping HMM model to file cache {0}".format(cache_file))
-            update_json_file(cache_file, {
-                'P_emit': self.model_data.get('P_emit'),
-                'P_trans': self.model_data.get('P_trans'),
-                'hmm_timestamp': int(time.time())
-            })
+            save_hmm_cache(cache_file, model_data)
+
+    def compact_model(self):
+        """
+        将日志合并进缓存的快照
+        :return:
+        """
+        cache_file = self._get_cache_file()
+
+        with FileLock(f'{cache_file}.lock'):
+            meta = read_cache_meta(cache_file)
+            if meta is None or not journal_exists(cache_file, 'hmm'):
+                return
 
-    def training(self, root=None, regexp=None, training_mode='update'):
+            logger.debug(
+                "Compacting HMM model journal into {0}".format(cache_file))
+            save_hmm_cache(cache_file,
+                           self._load_cached_model_data(cache_file, meta))
+
+    def _load_cached_model_data(self, cache_file, meta):
+        """
+        载入快照并重放日志里的训练记录
+        """
+        model_data = load_hmm_cache(cache_file)
+        for record in read_journal(cache_file, 'hmm',
+                                   meta.get('hmm_snapshot')):
+            model_data = self._apply_training(model_data, record)
+        return model_data
+
+    def _load_cached_model(self, cache_file, meta):
+        """
+        载入快照 快照里的对数概率表直接使用 日志里有训练记录时才需要重新计算
+        """
+        model = load_hmm_cache_model(cache_file)
+        records = read_journal(cache_file, 'hmm', meta.get('hmm_snapshot'))
+        if not records:
+            return model
+
+        model_data = model['model_data']
+        for record in records:
+            model_data = self._apply_training(model_data, record)
+        return self._build_model(model_data)
+
+    def _build_model(self, model_data):
+        return {'model_data': model_data,
+                'P_emit': self._prepare_P_emit(model_data),
+                'P_trans': self._prepare_P_trans(model_data)}
+
+    def _apply_training(self, model_data, record):
+        if record['mode'] == 'update':
+            return {'P_emit': self.merge_P_emit(record['P_emit'],
+                                                model_data.get('P_emit')),
+                    'P_trans': self.merge_P_trans(record['P_trans'],
+                                                  model_data.get('P_trans'))}
+        else:
+            return {'P_emit': record['P_emit'], 'P_trans': record['P_trans']}
+
+    def training(self, root=None, regexp=None, training_mode='update',
+                 lines=None, workers=None):
+        """
+        根据分好词的文本训练 逐行读取语料 一遍统计出发射计数和转移计数
+        :param root:
+        :param regexp:
+        :param training_mode: update 或者 replace
+        :param lines: 可迭代的分好词的文本行 给了则不再读取 root 下的文件
+        :param workers: 多进程统计的进程数 结果和单进程完全一致
+        :return:
+        """
         assert training_mode in ['update', 'replace']
+        self.check_initialized()
 
-        if root is None and self.training_root is None:
-            raise Exception('please give the training data root')
-        root = root if root is not None else self.training_root
-        regexp = regexp if regexp is not None else self.training_regexp
+        if lines is None:
+            if root is None and self.training_root is None:
+                raise Exception('please give the training data root')
+            root = root if root is not None else self.training_root
+            regexp = regexp if regexp is not None else self.training_regexp
         training_mode = training_mode if training_mode is not None else self.training_mode
 
-        if training_mode == 'update':
-            P_emit = train_emit_matrix(root, regexp)
-            P_trans = train_trans_matrix(root, regexp)
-            old_P_trans = self.model_data.get('P_trans')
-            old_P_emit = self.model_data.get('P_emit')
-
-            new_P_emit = self.merge_P_emit(P_emit, old_P_emit)
-            new_P_trans = self.merge_P_trans(P_trans, old_P_trans)
-            self.model_data = {'P_emit': new_P_emit, 'P_trans': new_P_trans}
-            self.P_emit = self._prepare_P_emit()
-            self.P_trans = self._prepare_P_trans()
-
-        elif training_mode == 'replace':
-            P_emit = train_emit_matrix(root, regexp)
-            P_trans = train_trans_matrix(root, regexp)
-            self.model_data = {'P_emit': P_emit, 'P_trans': P_trans}
-            self.P_emit = self._prepare_P_emit()
-            self.P_trans = self._prepare_P_trans()
+        counter, _ = count_training(root, regexp, lines, workers)
+        self._train_counts(counter.counts(), training_mode)
+
+    def _train_counts(self, counts, training_mode='update'):
+        """
+        :param counts: {'P_emit': 发射计数, 'P_trans': 转移计数}
+        :param training_mode:
+        :return:
+        """
+        record = dict(counts, mode=training_mode)
+
+        with self._update_lock:
+            self.model = self._build_model(
+                self._apply_training(self.model_data, record))
+
+            if training_mode == 'replace':
+                self._journal = []
+            self._journal.append(record)
+
+            self.model_version += 1
 
     def merge_P_trans(self, one, two):
         P_transMatrix = {'B': {'B': 0, 'E': 0, 'M': 0, 'S': 0},
@@ -188,90 +501,114 @@ class HMMSegment(TokenizerI, BaseSegment):
         if self.initialized:
             return
 
+        # 同样配置的分词器共用一份模型 训练时整体替换 不会就地修改
+        if self.model_file is not None:
+            model = open_mapped_model(self.model_file)
+            model = {'model_data': model.model_data,
+                     'P_emit': model.P_emit,
+                     'P_trans': model.P_trans}
+        else:
+            model = get_shared_model(
+                ('hmm', self._get_default_model_file(),
+                 self._get_cache_file()),
+                self._load_model)
+        self.model = model
+
+        self.model_version += 1
+        self.initialized = True
+
+    def _load_model(self):
         t1 = time.time()
 
         cache_file = self._get_cache_file()
 
         # use cache data
         use_cache_data = False
-        if os.path.isfile(cache_file):
-            hmm_timestamp = get_json_value(cache_file,
-                                           'hmm_timestamp')
-            if hmm_timestamp:
-                use_cache_data = True
+        meta = read_cache_meta(cache_file)
+        if meta is not None and meta.get('hmm_timestamp'):
+            use_cache_data = True
 
         if use_cache_data:
             logger.debug(
                 "Loading HMM model from cache {0}".format(cache_file))
-            P_trans = get_json_value(cache_file, 'P_trans')
-            P_emit = get_json_value(cache_file, 'P_emit')
-            self.model_data = {'P_emit': P_emit, 'P_trans': P_trans}
-
-            self.P_emit = self._prepare_P_emit()
-            self.P_trans = self._prepare_P_trans()
+            model = self._load_cached_model(cache_file, meta)
+        elif self._prebuilt_model_usable():
+            # 预先编译好的默认模型 对数概率表直接读取 也不写缓存
+            logger.debug("Loading prebuilt default HMM model")
+            return load_hmm_model(
+                get_resource_path(__softname__, DEFAULT_MODEL))
         else:
-            P_trans = get_json_value(self._get_default_model_file(),
-                                     'P_trans')
-            P_emit = get_json_value(self._get_default_model_file(),
-                                    'P_emit')
-            self.model_data = {'P_emit': P_emit, 'P_trans': P_trans}
-
-            self.P_emit = self._prepare_P_emit()
-            self.P_trans = self._prepare_P_trans()
-
-            self.save_model()
+            model_data = get_json_data(self._get_default_model_file())
+            model_data = {'P_emit': model_data['P_emit'],
+                          'P_trans': model_data['P_trans']}
+            model = self._build_model(model_data)
+            self._dump_model(model_data)
 
-        self.initialized = True
         logger.debug(
             "Loading model cost %.3f seconds." % (time.time() - t1))
         logger.debug("Prefix dict has been built succesfully.")
+        return model
+
+    def _prebuilt_model_usable(self):
+        """
+        自带的 default.model 只有确实是由现在的默认HMM模型编译的才使用
+        """
+        prebuilt_file = get_resource_path(__softname__, DEFAULT_MODEL)
+        if not os.path.isfile(prebuilt_file):
+            return False
+
+        try:
+            meta = read_model_meta(prebuilt_file)
+        except BinaryFormatError:
+            logger.debug("Prebuilt default HMM model is unreadable, ignore it")
+            return False
+
+        if meta.get('hmm_data_sha1') != file_sha1(
+                self._get_default_model_file()):
+            logger.debug("Prebuilt default HMM model is outdated, ignore it")
+            return False
+        return True
 
     def _get_default_model_file(self):
         return get_resource_path(__softname__, DEFAULT_HMM_DATA)
 
-    def _prepare_P_trans(self):
-        P_trans_data = self.model_data.get('P_trans')
-
-        P_trans = deepcopy(P_trans_data)
-
-        for k, v in P_trans.items():
-            count = sum(v.values())
-            for k2 in v:
-                P_trans[k][k2] = log(P_trans[k][k2] / count)
+    def _prepare_P_trans(self, model_data=None):
+        if model_data is None:
+            model_data = self.model_data
+        return log_prob_table(model_data.get('P_trans'))
 
-        return P_trans
-
-    def _prepare_P_emit(self):
-        P_emit_data = self.model_data.get('P_emit')
-
-        P_emit = deepcopy(P_emit_data)
-
-        for k, v in P_emit.items():
-            count = sum(v.values())
-            for k2 in v:
-                P_emit[k][k2] = log(P_emit[k][k2] / count)
-
-        return P_emit
+    def _prepare_P_emit(self, model_data=None):
+        if model_data is None:
+            model_data = self.model_data
+        return log_prob_table(model_data.get('P_emit'))
 
 
 def viterbi(obs, states, start_p, trans_p, emit_p):
-    V = [{}]  # tabular
-    path = {}
+    V = {}  # 上一个字各状态的最大概率
     for y in states:  # init
-        V[0][y] = start_p[y] + emit_p[y].get(obs[0], MIN_FLOAT)
-        path[y] = [y]
+        V[y] = start_p[y] + emit_p[y].get(obs[0], MIN_FLOAT)
+    # 每个字各状态的前一个状态 最后回溯出路径 不必每步复制整条路径
+    backs = []
     for t in range(1, len(obs)):
-        V.append({})
-        newpath = {}
+        char = obs[t]
+        newV = {}
+        back = {}
         for y in states:
-            em_p = emit_p[y].get(obs[t], MIN_FLOAT)
+            em_p = emit_p[y].get(char, MIN_FLOAT)
             (prob, state) = max(
-                [(V[t - 1][y0] + trans_p[y0].get(y, MIN_FLOAT) + em_p, y0) for
+                [(V[y0] + trans_p[y0].get(y, MIN_FLOAT) + em_p, y0) for
                  y0 in PrevStatus[y]])
-            V[t][y] = prob
-            newpath[y] = path[state] + [y]
-        path = newpath
+            newV[y] = prob
+            back[y] = state
+        V = newV
+        backs.append(back)
+
+    (prob, state) = max((V[y], y) for y in 'ES')
 
-    (prob, state) = max((V[len(obs) - 1][y], y) for y in 'ES')
+    path = [state]
+    for back in reversed(backs):
+        state = back[state]
+        path.append(state)
+    path.reverse()
 
-    return (prob, path[state])
+    return (prob, path)
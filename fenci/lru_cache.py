@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+def default_sizeof(key, value):
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+def words_sizeof(key, words):
+    """
+    缓存分词结果时 一条缓存是文本和切出来的词语元组
+    """
+    return sys.getsizeof(key) + sys.getsizeof(words) + sum(
+        sys.getsizeof(word) for word in words)
+
+
+class LRUCache(object):
+    """
+    按条目数和估算字节数限制大小的LRU缓存 记录命中 未命中 淘汰次数
+    """
+
+    def __init__(self, max_size=10000, max_bytes=None, sizeof=None):
+        """
+        :param max_size: 最多缓存多少条 None为不限
+        :param max_bytes: 最多缓存多少字节 None为不限
+        :param sizeof: sizeof(key, value) 估算一条缓存的字节数
+        """
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof if sizeof is not None else default_sizeof
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(key, value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._data[key] = (value, size)
+            self.nbytes += size
+
+            while (self.max_size is not None and len(
+                    self._data) > self.max_size) or (
+                    self.max_bytes is not None and
+                    self.nbytes > self.max_bytes):
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.nbytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'size': len(self._data),
+                'nbytes': self.nbytes}
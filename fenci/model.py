@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+词典模型和进程内共享的模型注册表
+
+同样配置（词典 HMM模型 缓存位置）的分词器共用同一份载入的模型，整个进程只载入一次。
+共用的模型不能就地修改，分词器要修改词典时先复制一份自己的。
+"""
+
+import math
+import threading
+from itertools import count
+from collections import Counter
+from collections.abc import Mapping
+
+from .nltk_utils import FreqDist
+from .frozen_dict import FrozenWordDict, get_dict_nbytes
+
+_versions = count(1)
+
+_missing = object()
+# 改动里表示基础字典里的这一项已经删除
+_deleted = object()
+
+
+def gen_prefix_dict(word_fd):
+    """
+    前缀词典 词语本身记录词频 词语的前缀记录为0
+    get_DAG 扫描时一旦片段不在前缀词典里即可停止
+    :param word_fd:
+    :return:
+    """
+    prefix_dict = {}
+
+    for word, freq in word_fd.items():
+        prefix_dict[word] = freq
+        for i in range(1, len(word)):
+            prefix_dict.setdefault(word[:i], 0)
+
+    return prefix_dict
+
+
+def gen_log_freq(word_fd):
+    """
+    词频取对数 calc 里只需查表 词频为0的词和未登录词一样按词频1计 不记录
+    :param word_fd:
+    :return:
+    """
+    return {word: math.log(freq) for word, freq in word_fd.items() if
+            freq > 0}
+
+
+class OverlayDict(Mapping):
+    """
+    不变的基础字典加上一份小的改动 查找时先查改动
+    """
+
+    def __init__(self, base, delta):
+        """
+        :param base: 基础字典 多个模型共用 不能再修改
+        :param delta: 改动 只属于这一个模型
+        """
+        self.base = base
+        self.delta = delta
+
+        # 分词时调用最频繁 用闭包省去方法查找
+        base_get = base.get
+        delta_get = delta.get
+
+        def get(key, default=None):
+            value = delta_get(key, _missing)
+            if value is _missing:
+                return base_get(key, default)
+            if value is _deleted:
+                return default
+            return value
+
+        self.get = get
+
+    def __getitem__(self, key):
+        value = self.delta.get(key, _missing)
+        if value is _missing:
+            return self.base[key]
+        if value is _deleted:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        value = self.delta.get(key, _missing)
+        if value is _missing:
+            return key in self.base
+        return value is not _deleted
+
+    def __iter__(self):
+        delta = self.delta
+        for key in self.base:
+            if delta.get(key) is not _deleted:
+                yield key
+        for key, value in delta.items():
+            if value is not _deleted and key not in self.base:
+                yield key
+
+    def __len__(self):
+        n = len(self.base)
+        for key, value in self.delta.items():
+            if value is _deleted:
+                n -= key in self.base
+            else:
+                n += key not in self.base
+        return n
+
+    def copy(self):
+        """
+        合并成一个普通的字典
+        """
+        merged = self.base.copy()
+        for key, value in self.delta.items():
+            if value is _deleted:
+                dict.pop(merged, key, None)
+            else:
+                dict.__setitem__(merged, key, value)
+        if isinstance(merged, FreqDist):
+            merged._N = None
+        return merged
+
+
+class OverlayFreqDist(OverlayDict):
+    """
+    词典的叠加视图 和 FreqDist 一样可以查询 只是不能直接修改 修改词典请用 add_word
+    需要一个可以修改的 FreqDist 时用 copy()
+    """
+
+    B = FreqDist.B
+    hapaxes = FreqDist.hapaxes
+    Nr = FreqDist.Nr
+    r_Nr = FreqDist.r_Nr
+    freq = FreqDist.freq
+    max = FreqDist.max
+    most_common = Counter.most_common
+    pprint = FreqDist.pprint
+    pformat = FreqDist.pformat
+    __repr__ = FreqDist.__repr__
+    __str__ = FreqDist.__str__
+
+    def N(self):
+        base_get = self.base.get
+        return self.base.N() + sum(freq - base_get(word, 0) for word, freq in
+                                   self.delta.items())
+
+
+class DictModel(object):
+    """
+    词典以及由词典派生出来的前缀词典 对数词频表 总词频
+
+    updated 给出的新模型和原来的模型共用基础词典 只另外记录一份改动
+    改动超过 MERGE_SIZE 项时再合并成新的基础词典
+    """
+
+    MERGE_SIZE = 4096
+
+    def __init__(self, word_fd=None, prefix_dict=None, log_freq=None):
+        """
+        :param word_fd: 词典 FreqDist 或者 FrozenWordDict
+        :param prefix_dict: 已经算好的前缀词典 不给则根据词典计算
+        :param log_freq: 已经算好的对数词频表 不给则根据词典计算
+        """
+        self.word_fd = word_fd if word_fd is not None else FreqDist()
+        self.frozen = isinstance(self.word_fd, FrozenWordDict)
+        # (词典 前缀词典 对数词频表) 三者的改动 没有改动时为None
+        self._delta = None
+        self._build_index(prefix_dict, log_freq)
+
+    def _build_index(self, prefix_dict=None, log_freq=None):
+        if self.frozen:
+            self.prefix_dict = self.word_fd.prefix_view
+            self.log_freq = self.word_fd.log_freq_view
+        else:
+            self.prefix_dict = prefix_dict if prefix_dict is not None else \
+                gen_prefix_dict(self.word_fd)
+            self.log_freq = log_freq if log_freq is not None else \
+                gen_log_freq(self.word_fd)
+
+        self.total = self.word_fd.N()
+        self.logtotal = math.log(self.total or 1)
+        self.version = next(_versions)
+
+    def update(self, fd):
+        """
+        就地更新词典 并同步更新前缀词典 对数词频表 和总词频
+        只能用于没有共用的模型 大批量的改动也只遍历一遍
+        :param fd: 本次新增的词频
+        :return:
+        """
+        if self.frozen:
+            raise Exception(
+                'the dictionary is frozen, please call unfreeze first.')
+
+        # 大批量的改动 先合并成普通的字典 免得每个词都要经过叠加视图查找
+        if self._delta is not None and len(fd) > self.MERGE_SIZE:
+            self._merge()
+
+        # 有改动时只写改动 基础词典还有别的模型在用
+        if self._delta is None:
+            word_fd, prefix_dict, log_freq = (self.word_fd, self.prefix_dict,
+                                              self.log_freq)
+        else:
+            word_fd, prefix_dict, log_freq = self._delta
+        word_get = self.word_fd.get
+        prefixes = self.prefix_dict
+        # 绕过 FreqDist.__setitem__ 免得每个词都让缓存的总词频失效 最后直接给出总词频
+        set_freq = dict.__setitem__
+        total = self.total
+
+        for word, n in fd.items():
+            freq = word_get(word, 0) + n
+            set_freq(word_fd, word, freq)
+            prefix_dict[word] = freq
+            # 前缀词典里每一项的前缀也都在前缀词典里 遇到已有的前缀即可停止
+            for i in range(len(word) - 1, 0, -1):
+                frag = word[:i]
+                if frag in prefixes:
+                    break
+                prefix_dict[frag] = 0
+            # 和 gen_log_freq 一致 词频不大于0的词不记录
+            if freq > 0:
+                log_freq[word] = math.log(freq)
+            elif self._delta is None:
+                log_freq.pop(word, None)
+            else:
+                log_freq[word] = _deleted
+            total += n
+
+        self.total = total
+        if isinstance(word_fd, FreqDist):
+            word_fd._N = total
+        self.logtotal = math.log(self.total or 1)
+        self.version = next(_versions)
+
+        if self._delta is not None and len(
+                self._delta[1]) > self.MERGE_SIZE:
+            self._merge()
+
+    def overlay(self):
+        """
+        共用基础词典的新模型 之后对它的修改只记在它自己的改动里 只需复制已有的改动
+        :return: DictModel
+        """
+        if self.frozen:
+            raise Exception(
+                'the dictionary is frozen, please call unfreeze first.')
+
+        model = DictModel.__new__(DictModel)
+        model.frozen = False
+        if self._delta is None:
+            base = (self.word_fd, self.prefix_dict, self.log_freq)
+            model._delta = ({}, {}, {})
+        else:
+            base = (self.word_fd.base, self.prefix_dict.base,
+                    self.log_freq.base)
+            model._delta = tuple(d.copy() for d in self._delta)
+        model.word_fd = OverlayFreqDist(base[0], model._delta[0])
+        model.prefix_dict = OverlayDict(base[1], model._delta[1])
+        model.log_freq = OverlayDict(base[2], model._delta[2])
+        model.total = self.total
+        model.logtotal = self.logtotal
+        model.version = next(_versions)
+        return model
+
+    def updated(self, fd):
+        """
+        加上这些改动的新模型 自己不变 耗时只和改动的多少有关 不必复制整个词典
+        :param fd: 本次新增的词频
+        :return: DictModel
+        """
+        model = self.overlay()
+        model.update(fd)
+        return model
+
+    def _merge(self):
+        """
+        把改动合并成一份新的基础词典 旧的基础词典可能还有别的模型在用 不能就地修改
+        """
+        self.word_fd = self.word_fd.copy()
+        self.prefix_dict = self.prefix_dict.copy()
+        self.log_freq = self.log_freq.copy()
+        if isinstance(self.word_fd, FreqDist):
+            self.word_fd._N = self.total
+        self._delta = None
+
+    def copy(self):
+        model = DictModel.__new__(DictModel)
+        model.frozen = self.frozen
+        model._delta = None
+        if self.frozen:
+            model.word_fd = self.word_fd
+            model.prefix_dict = self.prefix_dict
+            model.log_freq = self.log_freq
+        else:
+            model.word_fd = self.word_fd.copy()
+            model.prefix_dict = self.prefix_dict.copy()
+            model.log_freq = self.log_freq.copy()
+        model.total = self.total
+        model.logtotal = self.logtotal
+        model.version = next(_versions)
+        return model
+
+    def freeze(self):
+        if self.frozen:
+            return self
+        return DictModel(FrozenWordDict.from_freq_dist(self.word_fd))
+
+    def unfreeze(self):
+        if not self.frozen:
+            return self
+        return DictModel(FreqDist(dict(self.word_fd)))
+
+    def nbytes(self):
+        """
+        大概占用的内存字节数
+        """
+        if self.frozen:
+            return self.word_fd.nbytes
+
+        dicts = (self.word_fd, self.prefix_dict, self.log_freq)
+        if self._delta is not None:
+            dicts = tuple(d.base for d in dicts) + self._delta
+        return get_dict_nbytes(*dicts)
+
+    def __reduce__(self):
+        """
+        前缀词典和对数词频表可由词典重建 不必pickle
+        来自映射模型文件的 只传递对模型文件的引用
+        """
+        owner = getattr(self.word_fd, 'owner', None)
+        if owner is not None:
+            return getattr, (owner, 'dict_model')
+        if self._delta is not None:
+            return DictModel, (self.word_fd.copy(),)
+        return DictModel, (self.word_fd,)
+
+
+class _RegistryEntry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model = None
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_shared_model(key, loader):
+    """
+    同样的 key 整个进程只调用一次 loader 载入模型 之后都返回这同一份模型
+    不同 key 的模型可以同时载入
+    :param key: 模型配置
+    :param loader: 无参数的载入函数
+    :return:
+    """
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is None:
+            entry = _registry[key] = _RegistryEntry()
+
+    with entry.lock:
+        if entry.model is None:
+            entry.model = loader()
+        return entry.model
+
+
+def clear_shared_models():
+    with _registry_lock:
+        _registry.clear()
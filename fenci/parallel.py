@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+"""
+多进程并行分词
+
+每个工作进程在启动时接收一份分词器并初始化一次，之后一直复用。
+"""
+
+from collections import deque
+
+_worker_segment = None
+
+
+def init_worker(segment):
+    global _worker_segment
+
+    segment.check_initialized()
+    _worker_segment = segment
+
+
+def worker_cut(texts):
+    """
+    对一组文本批量分词 返回拼接在一起的分词结果
+    """
+    return [word for words in _worker_segment.cut_many(texts) for word in
+            words]
+
+
+def imap_bounded(pool, func, tasks, max_inflight):
+    """
+    类似 pool.imap 按任务顺序返回结果 但同时提交给进程池的任务不超过 max_inflight 个
+    pool.imap 会一口气把所有任务都塞进队列 输入很大时内存不可控
+    """
+    pending = deque()
+
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= max_inflight:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
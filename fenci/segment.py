@@ -2,20 +2,32 @@
 # -*-coding:utf-8-*-
 
 import re
-import math
 import logging
 import os
 import time
+import codecs
+from array import array
+from contextlib import contextmanager
+from multiprocessing import Pool
 
 from filelock import FileLock
 
 from .nltk_utils import TokenizerI, FreqDist
 from .base import BaseSegment
 from .hmm_segment import HMMSegment
-from .utils import normalized_path, get_json_value, update_json_file, get_resource_path
+from .train_hmm import count_training
+from .model import DictModel, get_shared_model
+from .binary_model import write_model, open_mapped_model, load_dict_model, \
+    read_model_meta, BinaryFormatError
+from .cache import read_cache_meta, load_dict_cache, save_dict_cache, \
+    file_signature, append_journal, read_journal, journal_exists, \
+    journal_needs_compact, cache_name, file_sha1
+from .parallel import init_worker, worker_cut, imap_bounded
+from .lru_cache import LRUCache, words_sizeof
+from .utils import normalized_path, get_resource_path
 from . import __softname__
-from .const import DEFAULT_DICT, DEFALUT_CACHE_NAME
-from .utils import strdecode, read_training_content
+from .const import DEFAULT_DICT, DEFAULT_HMM_DATA, DEFAULT_MODEL
+from .utils import strdecode, iter_offsets
 
 logger = logging.getLogger(__name__)
 
@@ -25,10 +37,93 @@ re_eng = re.compile('[a-zA-Z0-9]')
 re_han_default = re.compile(r"([\u4E00-\u9FD5a-zA-Z0-9+#&\._%\-]+)")
 re_skip_default = re.compile(r"([\r\n|\s]+)")
 
+re_han_char = re.compile(r"[\u4E00-\u9FD5a-zA-Z0-9+#&\._%\-]")
+re_skip_char = re.compile(r"[\r\n|\s]")
+
+SENTENCE_END = '\n。！？；!?;'
+
+
+def is_safe_boundary(text, pos):
+    """
+    在 pos 处将文本切开 分词结果是否不变
+    两边都是 re_han_default 的字符会切断一个中文块 两边都是空白会切断一段空白
+    """
+    if pos <= 0 or pos >= len(text):
+        return True
+
+    a, b = text[pos - 1], text[pos]
+    if re_han_char.match(a) and re_han_char.match(b):
+        return False
+    if re_skip_char.match(a) and re_skip_char.match(b):
+        return False
+    return True
+
+
+def find_safe_boundary(text, start, end, prefer_sentence_end=True):
+    """
+    在 (start, end] 之间从后往前找一个安全的切分点 默认优先选句子结尾 找不到返回 -1
+    """
+    fallback = -1
+    for pos in range(end, start, -1):
+        if is_safe_boundary(text, pos):
+            if not prefer_sentence_end or text[pos - 1] in SENTENCE_END:
+                return pos
+            if fallback < 0:
+                fallback = pos
+    return fallback
+
+
+def split_safe_chunks(text, chunk_size):
+    """
+    将长文本切分为大约 chunk_size 长的若干段 各段分词结果拼起来和整体分词结果一致
+    """
+    start = 0
+    N = len(text)
+    while N - start > chunk_size:
+        pos = find_safe_boundary(text, start, start + chunk_size)
+        if pos < 0:  # 超长的中文块 只能往后找
+            pos = start + chunk_size + 1
+            while not is_safe_boundary(text, pos):
+                pos += 1
+        yield text[start:pos]
+        start = pos
+
+    if start < N:
+        yield text[start:]
+
+
+def get_default_model_file():
+    return get_resource_path(__softname__, DEFAULT_MODEL)
+
+
+def read_dict_file(filename):
+    """
+    读取词典文件 每行 词语 词频
+    :param filename:
+    :return: FreqDist
+    """
+    word_fd = FreqDist()
+
+    with open(filename, 'rt', encoding='utf8') as f:
+        for line in f:
+            word, freq = line.split()[:2]
+            freq = int(freq)
+            word_fd.update({word: freq})
+
+    return word_fd
+
 
 class Segment(TokenizerI, BaseSegment):
     def __init__(self, dictionary=None, traning_root=None,
-                 traning_regexp='.*\.txt'):
+                 traning_regexp='.*\.txt', model_file=None, cache_dir=None):
+        """
+        :param dictionary: 自定义词典文件
+        :param traning_root:
+        :param traning_regexp:
+        :param model_file: export_model 导出的二进制模型文件 给了则直接mmap映射使用
+        :param cache_dir: 缓存目录 不给则用环境变量 FENCI_CACHE_DIR 或者系统临时目录
+        """
+        super().__init__()
         self.training_root = traning_root
         self.training_regexp = traning_regexp
 
@@ -39,68 +134,227 @@ class Segment(TokenizerI, BaseSegment):
             self.dictionary = normalized_path(dictionary)
             self.dictionary_type = 'custom'
 
-        self.word_fd = FreqDist()
+        # 模型是不可变的快照 修改时复制一份改好之后整体替换 分词的线程不会看到改了一半的模型
+        self.model = DictModel()
+        # batch_update 期间的修改先都改在这份私有的副本上
+        self._staging = None
+        # 上次保存之后词典的改动 增量保存时写入日志
+        self._dict_delta = FreqDist()
+
+        self.model_file = normalized_path(
+            model_file) if model_file is not None else None
 
-        self.cache_file = DEFALUT_CACHE_NAME
+        # 词典和HMM模型共用一份缓存 由两者的路径和内容决定
+        self.cache_file = cache_name(
+            self._get_dict_file(),
+            get_resource_path(__softname__, DEFAULT_HMM_DATA))
+        self.tmp_dir = cache_dir
 
         self.hmm_segment = HMMSegment(traning_root=traning_root,
                                       traning_regexp=traning_regexp,
-                                      cache_file=self.cache_file)
+                                      cache_file=self.cache_file,
+                                      model_file=self.model_file,
+                                      cache_dir=cache_dir)
 
         self.initialized = False
-        self.tmp_dir = None
 
-    def training(self, root=None, regexp=None):
+        self._pool = None
+        self._processes = 0
+        self._pool_version = None
+
+        self._block_cache = None
+        self._block_cache_version = None
+
+    @property
+    def model_version(self):
+        """
+        词典或HMM模型每次变化版本都会变 缓存和进程池据此判断是否过期
+        """
+        return self.model.version, self.hmm_segment.model_version
+
+    @property
+    def word_fd(self):
+        return self.model.word_fd
+
+    @property
+    def prefix_dict(self):
+        return self.model.prefix_dict
+
+    @property
+    def log_freq(self):
+        return self.model.log_freq
+
+    @property
+    def total(self):
+        return self.model.total
+
+    @property
+    def logtotal(self):
+        return self.model.logtotal
+
+    @property
+    def frozen(self):
+        return self.model.frozen
+
+    def __getstate__(self):
+        """
+        进程池和缓存不能也不必pickle
+        """
+        state = super().__getstate__()
+        state['_pool'] = None
+        state['_block_cache'] = None
+        state['_staging'] = None
+        return state
+
+    def training(self, root=None, regexp=None, lines=None, workers=None):
         """
         根据已经分好词的内容来训练
         :param root:
         :param regexp:
+        :param lines: 可迭代的分好词的文本行 给了则不再读取 root 下的文件
+        :param workers: 多进程统计的进程数 结果和单进程完全一致
         :return:
         """
         self.check_initialized()
+        self._check_not_frozen()
+
+        if lines is None:
+            root, regexp = self._training_source(root, regexp)
+
+        _, words = count_training(root, regexp, lines, workers,
+                                  count_hmm=False, count_words=True)
+
+        self._update_model(FreqDist(words))
 
+    def _training_source(self, root=None, regexp=None):
         if root is None and self.training_root is None:
             raise Exception('please give the training data root')
 
         root = root if root is not None else self.training_root
         regexp = regexp if regexp is not None else self.training_regexp
+        return root, regexp
 
-        content = read_training_content(root, regexp)
+    def _update_model(self, fd):
+        """
+        在新的模型上修改 再整体替换 正在分词的线程继续用旧的模型
+        旧的模型在最后一个用到它的线程结束之后自然释放
+        """
+        with self._update_lock:
+            if self._staging is not None:
+                model, delta = self._staging
+                model.update(fd)
+                delta.update(fd)
+                return
+
+            self._check_not_frozen()
+            # 新模型和旧模型共用基础词典 只复制改动部分
+            self.model = self.model.updated(fd)
+            self._dict_delta.update(fd)
+
+    @contextmanager
+    def batch_update(self):
+        """
+        期间的所有修改记在同一个新模型上 结束时一次性替换 期间分词仍用原来的模型
+        出错则放弃期间的所有修改
+        ```
+        with segment.batch_update():
+            for word in words:
+                segment.add_word(word)
+        ```
+        """
+        self.check_initialized()
 
-        content_list = content.split()
+        with self._update_lock:
+            if self._staging is not None:  # 嵌套
+                yield
+                return
 
-        fd = FreqDist(content_list)
+            self._check_not_frozen()
+            self._staging = (self.model.overlay(), FreqDist())
+            try:
+                yield
+                model, delta = self._staging
+            finally:
+                self._staging = None
 
-        self.word_fd.update(fd)
+            self.model = model
+            self._dict_delta.update(delta)
 
-    def training_hmm(self, root=None, regexp=None, update_dict=False):
+    def training_hmm(self, root=None, regexp=None, update_dict=False,
+                     lines=None, workers=None):
+        """
+        训练HMM模型 update_dict为True时语料里的词语也加入词典
+        语料只读一遍 词典和HMM模型的统计同时进行
+        :param root:
+        :param regexp:
+        :param update_dict:
+        :param lines: 可迭代的分好词的文本行 给了则不再读取 root 下的文件
+        :param workers: 多进程统计的进程数 结果和单进程完全一致
+        :return:
+        """
         self.check_initialized()
 
-        if root is None and self.training_root is None:
-            raise Exception('please give the training data root')
-        root = root if root is not None else self.training_root
-        regexp = regexp if regexp is not None else self.training_regexp
+        if lines is None:
+            root, regexp = self._training_source(root, regexp)
 
-        if update_dict:
-            self.training(root, regexp)
+        if not update_dict:
+            self.hmm_segment.training(root, regexp, lines=lines,
+                                      workers=workers)
+            return
 
-        self.hmm_segment.training(root, regexp)
+        self._check_not_frozen()
+        self.hmm_segment.check_initialized()
+        counter, words = count_training(root, regexp, lines, workers,
+                                        count_words=True)
+        self.hmm_segment._train_counts(counter.counts())
+        self._update_model(FreqDist(words))
 
     def gen_word_fd(self, filename):
-        word_fd = FreqDist()
+        return read_dict_file(filename)
 
-        with open(filename, 'rt', encoding='utf8') as f:
-            for line in f:
-                word, freq = line.split()[:2]
-                freq = int(freq)
-                word_fd.update({word: freq})
+    def freeze(self):
+        """
+        将词典转为紧凑的只读结构 FrozenWordDict 以节省内存
+        冻结之后 add_word load_userdict training 都不可用 需要先调用 unfreeze
+        :return:
+        """
+        self.check_initialized()
+
+        with self._update_lock:
+            if not self.frozen:
+                self.model = self.model.freeze()
+
+    def unfreeze(self):
+        with self._update_lock:
+            if self.frozen:
+                self.model = self.model.unfreeze()
 
-        return word_fd
+    def _check_not_frozen(self):
+        if self.frozen:
+            raise Exception(
+                'the dictionary is frozen, please call unfreeze first.')
+
+    def dictionary_nbytes(self):
+        """
+        词典相关数据结构大概占用的内存字节数
+        """
+        self.check_initialized()
+        return self.model.nbytes()
 
     def initialize(self):
         if self.initialized:  # 已经初始化了就不用初始化了
             return
 
+        # 同样配置的分词器共用一份模型 修改时都是复制一份再改 不会改到共用的模型
+        if self.model_file is not None:
+            self.model = open_mapped_model(self.model_file).dict_model
+        else:
+            self.model = get_shared_model(
+                ('dict', self.dictionary, self._get_cache_file()),
+                self._load_model)
+        self.initialized = True
+
+    def _load_model(self):
         logger.debug("Building prefix dict from %s ..." % (
                 self.dictionary or 'the default dictionary'))
         t1 = time.time()
@@ -109,32 +363,62 @@ class Segment(TokenizerI, BaseSegment):
 
         # use cache data
         use_cache_data = False
-        if os.path.isfile(cache_file):
-            word_fd_timestamp = get_json_value(cache_file,
-                                               'word_fd_timestamp')
-            if word_fd_timestamp:
-                if self.dictionary_type == 'custom':
-                    if int(word_fd_timestamp) > os.path.getmtime(
-                            self.dictionary):
-                        use_cache_data = True
-                else:
-                    use_cache_data = True
+        meta = read_cache_meta(cache_file)
+        # 缓存文件名已经由词典的路径和内容决定 不必再比较时间
+        if meta is not None and meta.get('word_fd_timestamp'):
+            use_cache_data = True
 
         if use_cache_data:
             logger.debug("Loading model from cache {0}".format(cache_file))
 
-            word_fd = get_json_value(cache_file, 'word_fd')
-            self.word_fd = FreqDist(word_fd)
+            model = self._load_cached_model(cache_file, meta)
+        elif self._prebuilt_model_usable():
+            # 预先编译好的默认模型 不必解析词典 也不写缓存
+            logger.debug("Loading prebuilt default model")
+
+            model = load_dict_model(get_default_model_file())
         else:
             word_fd = self.gen_word_fd(self._get_dict_file())
-            self.word_fd = FreqDist(word_fd)
+            model = DictModel(word_fd)
 
-            self.save_model(save_hmm=False)
+            self._dump_model(model)
 
-        self.initialized = True
         logger.debug(
             "Loading model cost %.3f seconds." % (time.time() - t1))
         logger.debug("Prefix dict has been built succesfully.")
+        return model
+
+    def _prebuilt_model_usable(self):
+        """
+        自带的 default.model 只有确实是由现在的默认词典编译的才使用
+        词典被改过时 按词典重新生成
+        """
+        model_file = get_default_model_file()
+        if self.dictionary_type != 'default' or not os.path.isfile(model_file):
+            return False
+
+        try:
+            meta = read_model_meta(model_file)
+        except BinaryFormatError:
+            logger.debug("Prebuilt default model is unreadable, ignore it")
+            return False
+
+        # sha1 生成缓存文件名时已经算过了
+        if meta.get('dictionary_sha1') != file_sha1(self._get_dict_file()):
+            logger.debug("Prebuilt default model is outdated, ignore it")
+            return False
+        return True
+
+    @staticmethod
+    def _load_cached_model(cache_file, meta):
+        """
+        载入快照并重放日志里的改动
+        """
+        model = load_dict_cache(cache_file)
+        for record in read_journal(cache_file, 'dict',
+                                   meta.get('dict_snapshot')):
+            model.update(record['fd'])
+        return model
 
     def _get_dict_file(self):
         if self.dictionary == DEFAULT_DICT:
@@ -142,17 +426,26 @@ class Segment(TokenizerI, BaseSegment):
         else:
             return self.dictionary
 
-    def get_DAG(self, sentence):
+    def get_DAG(self, sentence, model=None):
+        """
+        :param sentence:
+        :param model: 用哪个模型 同一句话的各个步骤要用同一个模型 不给则用当前的模型
+        :return:
+        """
         self.check_initialized()
 
         DAG = {}
         N = len(sentence)
+        prefix_get = (model or self.model).prefix_dict.get
         for k in range(N):
             tmplist = []
             i = k
             frag = sentence[k]
             while i < N:
-                if self.word_fd.get(frag, 0) > 0:
+                freq = prefix_get(frag)
+                if freq is None:  # 没有词语以此片段开头 不必再往后扫描
+                    break
+                if freq > 0:
                     tmplist.append(i)
                 i += 1
                 frag = sentence[k:i + 1]
@@ -161,22 +454,35 @@ class Segment(TokenizerI, BaseSegment):
             DAG[k] = tmplist
         return DAG
 
-    def calc(self, sentence, DAG, route):
+    def calc(self, sentence, DAG, route, model=None):
         N = len(sentence)
         route[N] = (0, 0)
 
-        logtotal = math.log(self.word_fd.N())
+        model = model or self.model
+        logtotal = model.logtotal
+        log_freq_get = model.log_freq.get
         for idx in range(N - 1, -1, -1):  # 逆序规划 选择一条整个路径频率最大的句子
             route[idx] = max(
-                (math.log(self.word_fd.get(sentence[idx:x + 1]) or 1) -
+                (log_freq_get(sentence[idx:x + 1], 0.0) -
                  logtotal + route[x + 1][0],
                  x) for x in DAG[idx])  # x 终点索引点 idx 考察开始点
 
-    def __cut_DAG(self, sentence):
-        DAG = self.get_DAG(sentence)
+    def __cut_DAG(self, sentence, model=None, hmm_cut=None):
+        self.check_initialized()
+        model = model or self.model
+        DAG = self.get_DAG(sentence, model)
         route = {}
-        self.calc(sentence, DAG, route)
+        self.calc(sentence, DAG, route, model)
 
+        return self.__cut_route(sentence, route, model, hmm_cut)
+
+    def __cut_route(self, sentence, route, model, hmm_cut=None):
+        """
+        :param hmm_cut: 词典里找不到的片段交给它来分 默认为 hmm_segment.cut
+        """
+        word_fd_get = model.word_fd.get
+        if hmm_cut is None:
+            hmm_cut = self.hmm_segment.cut
         x = 0
         buf = ''
         N = len(sentence)
@@ -191,8 +497,8 @@ class Segment(TokenizerI, BaseSegment):
                         yield buf
                         buf = ''
                     else:
-                        if not self.word_fd.get(buf):  # 词典里找不到的词 用HMM来分
-                            recognized = self.hmm_segment.cut(buf)
+                        if not word_fd_get(buf):  # 词典里找不到的词 用HMM来分
+                            recognized = hmm_cut(buf)
                             for t in recognized:
                                 yield t
                         else:
@@ -207,8 +513,8 @@ class Segment(TokenizerI, BaseSegment):
         if buf:
             if len(buf) == 1:
                 yield buf
-            elif not self.word_fd.get(buf):
-                recognized = self.hmm_segment.cut(buf)
+            elif not word_fd_get(buf):
+                recognized = hmm_cut(buf)
                 for t in recognized:
                     yield t
             else:
@@ -218,15 +524,64 @@ class Segment(TokenizerI, BaseSegment):
     def tokenize(self, s):
         return self.lcut(s)
 
-    def cut(self, sentence):
+    def tokenize_sents(self, strings):
+        return self.lcut_many(strings)
+
+    def span_tokenize(self, s):
+        for word, start, end in self.cut(s, with_offsets=True):
+            yield start, end
+
+    def span_array(self, s):
         """
+        紧凑形式的 span_tokenize 起止位置依次放在一个 array('I') 里面
+        :param s:
+        :return: array('I', [start0, end0, start1, end1, ...])
+        """
+        spans = array('I')
+        for word, start, end in self.cut(s, with_offsets=True):
+            spans.append(start)
+            spans.append(end)
+        return spans
+
+    def span_tokenize_sents(self, strings, compact=False):
+        """
+        批量 span_tokenize 走 cut_many 的批量分词
+        :param strings:
+        :param compact: 为True时每个句子返回 span_array 的紧凑形式
+        :return:
+        """
+        for words in self.cut_many(strings):
+            if compact:
+                spans = array('I')
+                for word, start, end in iter_offsets(words):
+                    spans.append(start)
+                    spans.append(end)
+                yield spans
+            else:
+                yield [(start, end) for word, start, end in
+                       iter_offsets(words)]
+
+    def cut(self, sentence, with_offsets=False):
+        """
+        分词
+        :param sentence:
+        :param with_offsets: 为True时返回 (word, start, end)
+        :return:
         """
         sentence = strdecode(sentence)
+        words = self._cut(sentence)
+        if with_offsets:
+            return iter_offsets(words)
+        return words
 
+    def _cut(self, sentence, cut_block=None):
         re_han = re_han_default
-        re_skip = re_skip_default
 
-        cut_block = self.__cut_DAG
+        if cut_block is None:
+            if self._block_cache is not None:
+                cut_block = self._cut_block_cached
+            else:
+                cut_block = self.__cut_DAG
 
         blocks = re_han.split(sentence)
 
@@ -238,20 +593,420 @@ class Segment(TokenizerI, BaseSegment):
                 for word in cut_block(blk):
                     yield word
             else:
-                tmp = re_skip.split(blk)
-                for x in tmp:
+                yield from self._cut_skip(blk)
 
-                    if re_skip.match(x):  # 多个空白不分开
-                        yield x
-                    else:
-                        for xx in x:  # 剩下来的全部分开
-                            yield xx
+    @staticmethod
+    def _cut_skip(blk):
+        tmp = re_skip_default.split(blk)
+        for x in tmp:
+
+            if re_skip_default.match(x):  # 多个空白不分开
+                yield x
+            else:
+                for xx in x:  # 剩下来的全部分开
+                    yield xx
+
+    def cut_for_search(self, sentence, with_offsets=False):
+        """
+        搜索引擎模式 长词之外还给出其中在词典里的子词 子词直接取自分词时建好的DAG
+        :param sentence:
+        :param with_offsets: 为True时返回 (word, start, end)
+        :return:
+        """
+        sentence = strdecode(sentence)
+        words = self._cut_for_search(sentence)
+        if with_offsets:
+            return words
+        return (word for word, start, end in words)
+
+    def lcut_for_search(self, sentence, with_offsets=False):
+        return list(self.cut_for_search(sentence, with_offsets=with_offsets))
+
+    def _cut_for_search(self, sentence):
+        return self._cut_blocks_with_offsets(sentence,
+                                             self.__cut_DAG_for_search)
+
+    def _cut_blocks_with_offsets(self, sentence, cut_block):
+        """
+        中文块交给 cut_block 处理 其返回的位置都是相对块的 这里统一换算成相对原文的位置
+        """
+        pos = 0
+        for blk in re_han_default.split(sentence):
+            if not blk:
+                continue
+            if re_han_default.match(blk):
+                words = cut_block(blk)
+            else:
+                words = iter_offsets(self._cut_skip(blk))
+
+            for word, start, end in words:
+                yield word, pos + start, pos + end
+            pos += len(blk)
+
+    def cut_all(self, sentence, with_offsets=False, min_freq=1):
+        """
+        全模式 给出文本中出现的所有词典词语 包括相互重叠的
+        没有任何词典词语开头的字单独给出
+        :param sentence:
+        :param with_offsets: 为True时返回 (word, start, end)
+        :param min_freq: 词频低于此值的词语不给出
+        :return:
+        """
+        self.check_initialized()
+        sentence = strdecode(sentence)
+        words = self._cut_blocks_with_offsets(
+            sentence, lambda blk: self.__cut_all_block(blk, min_freq))
+        if with_offsets:
+            return words
+        return (word for word, start, end in words)
+
+    def lcut_all(self, sentence, with_offsets=False, min_freq=1):
+        return list(self.cut_all(sentence, with_offsets=with_offsets,
+                                 min_freq=min_freq))
+
+    def __cut_all_block(self, sentence, min_freq):
+        """
+        和 get_DAG 同样的扫描 只是直接给出每条边 不构建DAG
+        """
+        prefix_get = self.prefix_dict.get
+        N = len(sentence)
+        for k in range(N):
+            is_word_start = False
+            i = k
+            frag = sentence[k]
+            while i < N:
+                freq = prefix_get(frag)
+                if freq is None:
+                    break
+                if freq > 0:
+                    is_word_start = True
+                    if freq >= min_freq:
+                        yield frag, k, i + 1
+                i += 1
+                frag = sentence[k:i + 1]
+            if not is_word_start:
+                yield sentence[k], k, k + 1
+
+    def __cut_DAG_for_search(self, sentence):
+        self.check_initialized()
+        model = self.model
+        DAG = self.get_DAG(sentence, model)
+        route = {}
+        self.calc(sentence, DAG, route, model)
+
+        for word, start, end in iter_offsets(
+                self.__cut_route(sentence, route, model)):
+            if end - start > 2:
+                # DAG里落在这个词内部的边就是词典里的子词 先短后长 同长度从左到右
+                sub_words = sorted(
+                    (j + 1 - k, k) for k in range(start, end - 1)
+                    for j in DAG[k] if k < j < end and
+                    j + 1 - k < end - start)
+                for length, k in sub_words:
+                    yield sentence[k:k + length], k, k + length
+            yield word, start, end
+
+    def lcut(self, sentence, with_offsets=False):
+        return list(self.cut(sentence, with_offsets=with_offsets))
+
+    def enable_cache(self, max_size=10000, max_bytes=None):
+        """
+        缓存每个中文块的分词结果 词典或HMM模型变化后缓存自动清空
+        :param max_size: 最多缓存多少个块
+        :param max_bytes: 缓存大概最多占用多少字节
+        :return:
+        """
+        self.check_initialized()
+        self.hmm_segment.check_initialized()
+
+        self._block_cache = LRUCache(max_size=max_size, max_bytes=max_bytes,
+                                     sizeof=words_sizeof)
+        self._block_cache_version = self.model_version
+
+    def disable_cache(self):
+        self._block_cache = None
+
+    def cache_info(self):
+        if self._block_cache is None:
+            return None
+        return self._block_cache.info()
+
+    def _cut_block_cached(self, blk):
+        cache = self._block_cache
+        self.check_initialized()
+        model = self.model
+        version = (model.version, self.hmm_segment.model_version)
+        if version != self._block_cache_version:
+            cache.clear()
+            self._block_cache_version = version
+
+        words = cache.get(blk)
+        if words is None:
+            words = tuple(self.__cut_DAG(blk, model))
+            # 期间模型换了 这个结果就不放进缓存了
+            if version == self._block_cache_version:
+                cache.put(blk, words)
+        return words
+
+    def _cut_batch(self, sentences):
+        """
+        批量分词的核心 sentences 里面已经没有重复的句子
+        :param sentences:
+        :return: 和 sentences 一一对应的分词结果
+        """
+        if self._block_cache is not None:
+            # 重复的块直接用缓存 不必再批量
+            lcut = self.lcut
+            return [lcut(sentence) for sentence in sentences]
+
+        self.check_initialized()
+        model = self.model
+
+        # 先照常分词 词典里找不到的片段暂时记下它的序号 最后一起交给HMM批量分
+        bufs = []
+
+        def hmm_cut(buf):
+            bufs.append(buf)
+            return (len(bufs) - 1,)
+
+        def cut_block(blk):
+            return self.__cut_DAG(blk, model, hmm_cut)
+
+        streams = [list(self._cut(sentence, cut_block)) for sentence in
+                   sentences]
+        if not bufs:
+            return streams
+
+        buf_words = self.hmm_segment.lcut_many(bufs)
+
+        results = []
+        for stream in streams:
+            words = []
+            for word in stream:
+                if isinstance(word, int):
+                    words.extend(buf_words[word])
+                else:
+                    words.append(word)
+            results.append(words)
+        return results
+
+    def cut_many(self, sentences, batch_size=1000):
+        """
+        批量分词 每 batch_size 个句子为一批 一批之内相同的句子只分一次
+        按输入顺序逐个返回分词结果
+        :param sentences: 可迭代的句子
+        :param batch_size:
+        :return:
+        """
+        self.check_initialized()
+
+        batch = []
+        for sentence in sentences:
+            batch.append(strdecode(sentence))
+            if len(batch) >= batch_size:
+                yield from self._cut_dedup(batch)
+                batch = []
+
+        if batch:
+            yield from self._cut_dedup(batch)
+
+    def _cut_dedup(self, batch):
+        unique = list(dict.fromkeys(batch))
+        results = dict(zip(unique, self._cut_batch(unique)))
+
+        for sentence in batch:
+            yield list(results[sentence])
+
+    def lcut_many(self, sentences, batch_size=1000):
+        return list(self.cut_many(sentences, batch_size=batch_size))
+
+    def cut_stream(self, chunks, encoding='utf8'):
+        """
+        流式分词 只在不影响分词结果的位置切开 分词结果和整体分词一致
+        内存占用只和文本片段大小（以及最长的不可切分片段）有关
+        :param chunks: 可迭代的文本片段 str 或者bytes
+        :param encoding: bytes 片段的编码
+        :return:
+        """
+        decoder = codecs.getincrementaldecoder(encoding)()
+
+        # 还没切出去的文本 其中的位置都已确认不能切开 新片段来了只需检查新的位置
+        pending = []
+        last = ''
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            if not chunk:
+                continue
+
+            # 带上前一个字符 才能判断能否在新片段开头切
+            # 最后一个字符之后是什么还不知道 不能在末尾切
+            text = last + chunk
+            pos = find_safe_boundary(text, 0, len(text) - 1,
+                                     prefer_sentence_end=False)
+            if pos > 0:
+                pos -= len(last)
+                pending.append(chunk[:pos])
+                yield from self.cut(''.join(pending))
+                pending = [chunk[pos:]]
+            else:
+                pending.append(chunk)
+            last = chunk[-1]
+
+        pending.append(decoder.decode(b'', final=True))
+        buf = ''.join(pending)
+        if buf:
+            yield from self.cut(buf)
+
+    def _read_chunks(self, path_or_fileobj, encoding, chunk_size):
+        if isinstance(path_or_fileobj, (str, os.PathLike)):
+            with open(path_or_fileobj, 'rt', encoding=encoding) as f:
+                yield from iter(lambda: f.read(chunk_size), '')
+        else:
+            while True:
+                chunk = path_or_fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def cut_file(self, path_or_fileobj, output=None, sep=' ', encoding='utf8',
+                 chunk_size=65536):
+        """
+        对文件流式分词
+        :param path_or_fileobj: 文件路径或者已打开的文件对象
+        :param output: 不给则返回分词结果的生成器 给了文件路径或者已打开的文件对象
+        则将分词结果用 sep 连接起来写入 返回写入的词数
+        :param sep:
+        :param encoding: 读写文件路径 以及读取以二进制方式打开的文件对象时所用的编码
+        以文本方式打开的文件对象读出来已经是str 用不到它
+        :param chunk_size: 每次读取的字符数（二进制方式打开的文件对象为字节数）
+        :return:
+        """
+        words = self.cut_stream(
+            self._read_chunks(path_or_fileobj, encoding, chunk_size),
+            encoding=encoding)
 
-    def lcut(self, sentence):
-        return list(self.cut(sentence))
+        if output is None:
+            return words
+
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, 'wt', encoding=encoding) as f:
+                return self._write_words(words, f, sep)
+        else:
+            return self._write_words(words, output, sep)
+
+    @staticmethod
+    def _write_words(words, f, sep, batch_size=10000):
+        count = 0
+        batch = []
+        for word in words:
+            batch.append(word)
+            if len(batch) >= batch_size:
+                if count:
+                    f.write(sep)
+                f.write(sep.join(batch))
+                count += len(batch)
+                batch = []
+
+        if batch:
+            if count:
+                f.write(sep)
+            f.write(sep.join(batch))
+            count += len(batch)
+
+        return count
+
+    def enable_parallel(self, processes=None):
+        """
+        启动并行分词的进程池 每个工作进程载入一次当前的模型
+        之后修改了模型 下次并行分词时会自动重启进程池
+        :param processes: 进程数 默认为cpu核数
+        :return:
+        """
+        self.check_initialized()
+        self.hmm_segment.check_initialized()
+        self.disable_parallel()
+
+        self._processes = processes or os.cpu_count() or 1
+        self._pool = Pool(self._processes, initializer=init_worker,
+                          initargs=(self,))
+        self._pool_version = self.model_version
+
+    def disable_parallel(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def cut_parallel(self, text_or_lines, processes=None, chunk_size=100000,
+                     max_inflight=None):
+        """
+        多进程并行分词 按顺序返回分词结果
+        :param text_or_lines: 一整段文本 或者可迭代的多行文本 多行文本每行单独分词
+        :param processes: 没有调用 enable_parallel 时临时启动的进程数
+        :param chunk_size: 每个任务大约包含的字符数
+        :param max_inflight: 同时提交的任务数上限 默认为进程数的两倍
+        :return:
+        """
+        temporary = self._pool is None
+        if temporary:
+            self.enable_parallel(processes)
+        elif self._pool_version != self.model_version:
+            self.enable_parallel(self._processes)
+
+        pool = self._pool
+        if max_inflight is None:
+            max_inflight = 2 * self._processes
+
+        if isinstance(text_or_lines, (str, bytes)):
+            tasks = ([chunk] for chunk in
+                     split_safe_chunks(strdecode(text_or_lines), chunk_size))
+        else:
+            tasks = self._group_lines(text_or_lines, chunk_size)
+
+        try:
+            for words in imap_bounded(pool, worker_cut, tasks, max_inflight):
+                yield from words
+        finally:
+            if temporary:
+                self.disable_parallel()
+
+    def lcut_parallel(self, text_or_lines, processes=None, chunk_size=100000,
+                      max_inflight=None):
+        return list(self.cut_parallel(text_or_lines, processes=processes,
+                                      chunk_size=chunk_size,
+                                      max_inflight=max_inflight))
+
+    @staticmethod
+    def _group_lines(lines, chunk_size):
+        group = []
+        size = 0
+        for line in lines:
+            line = strdecode(line)
+            group.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield group
+                group = []
+                size = 0
+
+        if group:
+            yield group
 
     def load_userdict(self, filename):
+        """
+        载入用户词典 每行 词语 [词频] [词性] 所有词语一次性更新到词典
+        :param filename:
+        :return:
+        """
         self.check_initialized()
+        self._check_not_frozen()
+
+        self.add_words(self._read_userdict(filename))
+
+    @staticmethod
+    def _read_userdict(filename):
+        match = re_userdict.match
 
         with open(filename, 'rt', encoding='utf8') as f:
             for line in f:
@@ -262,7 +1017,7 @@ class Segment(TokenizerI, BaseSegment):
                     continue
 
                 # 第三步：匹配有效行（原逻辑）
-                match_result = re_userdict.match(line_stripped)
+                match_result = match(line_stripped)
                 # 额外防护：如果正则匹配失败（非空白行但格式错误），也跳过并提示
                 if not match_result:
                     # 可选：打印警告日志，方便排查格式错误的行
@@ -273,11 +1028,11 @@ class Segment(TokenizerI, BaseSegment):
                 word, freq, tag = match_result.groups()
                 word = word.strip()  # 双重防护，确保词无首尾空白
                 if freq is not None:
-                    freq = freq.strip()
+                    freq = int(freq)
                 else:
                     freq = 1
 
-                self.add_word(word, freq)
+                yield word, freq
 
     def add_word(self, word, freq=1):
         """
@@ -289,14 +1044,125 @@ class Segment(TokenizerI, BaseSegment):
         word = strdecode(word)
         freq = int(freq)
 
-        self.word_fd.update({word: freq})
+        self._update_model({word: freq})
 
-    def save_model(self, save_hmm=False):
+    def add_words(self, words):
+        """
+        批量添加词语 先汇总 再一次性更新词典 前缀词典 对数词频表和总词频
+        :param words: 可迭代对象 元素为词语 或者 (词语, 词频)
+        :return:
+        """
+        self.check_initialized()
+        self._check_not_frozen()
+
+        fd = {}
+        get = fd.get
+        for item in words:
+            if isinstance(item, (str, bytes)):
+                word, freq = item, 1
+            else:
+                word, freq = item
+            if not isinstance(word, str):
+                word = strdecode(word)
+            fd[word] = get(word, 0) + int(freq)
+
+        if fd:
+            self._update_model(fd)
+
+    def save_model(self, save_hmm=False, incremental=True):
         """
         保存模型文件
         :param save_hmm:
+        :param incremental: 为True时只把上次保存之后的改动追加到日志里
+        为False时整体重写缓存
+        :return:
+        """
+        if incremental:
+            self._append_journal()
+        else:
+            with self._pending_dict_delta() as (delta, model):
+                self._dump_model(model)
+
+        if save_hmm:
+            self.hmm_segment.save_model(incremental=incremental)
+
+    def compact_model(self):
+        """
+        将日志合并进缓存的快照 save_model 时日志太大也会自动合并
+        :return:
+        """
+        self._compact_journal()
+        self.hmm_segment.compact_model()
+
+    def _compact_journal(self):
+        cache_file = self._get_cache_file()
+
+        with FileLock(f'{cache_file}.lock'):
+            meta = read_cache_meta(cache_file)
+            if meta is None or not journal_exists(cache_file, 'dict'):
+                return
+
+            logger.debug(
+                "Compacting model journal into {0}".format(cache_file))
+            model = self._load_cached_model(cache_file, meta)
+            save_dict_cache(cache_file, model.word_fd, model.prefix_dict,
+                            source=meta.get('dict_source'))
+
+    @contextmanager
+    def _pending_dict_delta(self):
+        """
+        在锁内取走还没保存的改动和与之对应的模型 换上一份空的改动
+        写文件期间其他线程的修改记在新的改动里 不会丢失
+        写文件出错则把取走的改动合并回去 下次保存时再写
+        """
+        with self._update_lock:
+            delta, self._dict_delta = self._dict_delta, FreqDist()
+            model = self.model
+
+        try:
+            yield delta, model
+        except BaseException:
+            with self._update_lock:
+                self._dict_delta.update(delta)
+            raise
+
+    def _append_journal(self):
+        cache_file = self._get_cache_file()
+
+        with self._pending_dict_delta() as (delta, model):
+            if not delta:
+                return
+
+            with FileLock(f'{cache_file}.lock'):
+                logger.debug(
+                    "Appending model changes to journal {0}".format(
+                        cache_file))
+                saved = append_journal(cache_file, 'dict',
+                                       [{'fd': dict(delta)}])
+                compact = saved and journal_needs_compact(cache_file, 'dict')
+
+            if not saved:
+                # 缓存还没有快照 取走改动时的模型已经包含了这些改动
+                self._dump_model(model)
+
+        if compact:
+            self._compact_journal()
+
+    def export_model(self, filename):
+        """
+        将当前的词典和HMM模型导出为二进制模型文件
+        多个进程用 Segment(model_file=filename) mmap映射同一个文件 共用一份内存
+        :param filename:
         :return:
         """
+        self.check_initialized()
+        self.hmm_segment.check_initialized()
+
+        write_model(filename, self.word_fd,
+                    dict(self.hmm_segment.model_data),
+                    meta={'dictionary': self.dictionary})
+
+    def _dump_model(self, model):
         cache_file = self._get_cache_file()
 
         wlock = FileLock(f'{cache_file}.lock')
@@ -305,10 +1171,5 @@ class Segment(TokenizerI, BaseSegment):
             logger.debug(
                 "Dumping model to file cache {0}".format(cache_file))
 
-            update_json_file(cache_file, {
-                'word_fd': dict(self.word_fd),
-                'word_fd_timestamp': int(time.time())
-            })
-
-        if save_hmm:
-            self.hmm_segment.save_model()
+            save_dict_cache(cache_file, model.word_fd, model.prefix_dict,
+                            source=file_signature(self._get_dict_file()))
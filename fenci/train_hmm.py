@@ -4,9 +4,20 @@
 import os
 
 from math import log
+from itertools import islice
+from collections import Counter
+from multiprocessing import Pool
 
-from fenci.utils import read_training_content
-from .nltk_utils import FreqDist, bigrams, str2tuple
+from fenci.utils import read_training_content, iter_training_lines, \
+    find_trainning_files
+from .nltk_utils import str2tuple
+from .parallel import imap_bounded
+
+STATES = 'BEMS'
+
+# 多进程训练时每个任务处理的语料字节数 以及直接给出文本行时每个任务的行数
+CHUNK_SIZE = 4 << 20
+CHUNK_LINES = 20000
 
 
 def suggest_bmes(word):
@@ -41,6 +52,260 @@ def prepare_bmes_content(root, regexp):
     return new_bmes_content_list
 
 
+class HMMCounter(object):
+    """
+    单遍统计HMM的转移计数和发射计数
+    每个字的状态直接由词长得出 不生成BMES字符串 内存占用只和模型大小有关
+
+    和原来基于 prepare_bmes_content 的统计结果完全一致：
+    整个语料的字前后相连 转移计数跨越词语和行的边界
+    发射计数记的是每个字的状态和紧接着的下一个字 默认HMM模型就是这样训练的
+    """
+
+    def __init__(self):
+        self.emit = {state: Counter() for state in STATES}
+        self.trans = Counter()
+        # 第一个字 以及它的状态 合并前面一段语料的统计结果时用
+        self.first = None
+        # 上一个字的状态 跨行跨文件延续
+        self.prev = None
+
+    def update(self, lines):
+        """
+        :param lines: 可迭代的分好词的文本 词语之间以空白分隔
+        :return: self
+        """
+        emit = self.emit
+        emit_B = emit['B']
+        emit_M = emit['M']
+        trans = self.trans
+        prev = self.prev
+
+        for line in lines:
+            for word in line.split():
+                n = len(word)
+                if prev is not None:
+                    emit[prev][word[0]] += 1
+                    trans[prev + ('S' if n == 1 else 'B')] += 1
+                else:
+                    self.first = (word[0], 'S' if n == 1 else 'B')
+
+                if n == 1:
+                    prev = 'S'
+                    continue
+
+                # B M...M E 各自发射下一个字 E的下一个字在下一个词语里
+                emit_B[word[1]] += 1
+                if n == 2:
+                    trans['BE'] += 1
+                else:
+                    for char in word[2:]:
+                        emit_M[char] += 1
+                    trans['BM'] += 1
+                    trans['MM'] += n - 3
+                    trans['ME'] += 1
+                prev = 'E'
+
+        self.prev = prev
+        return self
+
+    def merge(self, other):
+        """
+        合并紧接在后面的一段语料的统计结果 两段之间的转移和发射在这里补上
+        :param other: 从这一段开头开始统计的 HMMCounter
+        :return: self
+        """
+        if other.first is None:
+            return self
+
+        if self.prev is not None:
+            char, state = other.first
+            self.emit[self.prev][char] += 1
+            self.trans[self.prev + state] += 1
+        else:
+            self.first = other.first
+
+        for state in STATES:
+            self.emit[state].update(other.emit[state])
+        self.trans.update(other.trans)
+        self.prev = other.prev
+        return self
+
+    def counts(self):
+        """
+        :return: {'P_emit': 发射计数, 'P_trans': 转移计数} 转移计数不记录为0的项
+        """
+        P_trans = {}
+        for key in sorted(self.trans):
+            if self.trans[key]:
+                P_trans.setdefault(key[0], {})[key[1]] = self.trans[key]
+
+        return {'P_emit': {state: dict(self.emit[state]) for state in STATES},
+                'P_trans': P_trans}
+
+
+def train_hmm(lines):
+    """
+    统计分好词的文本的HMM发射计数和转移计数
+    :param lines: 可迭代的文本行 可以是生成器
+    :return: {'P_emit': 发射计数, 'P_trans': 转移计数}
+    """
+    return HMMCounter().update(lines).counts()
+
+
+def split_training_files(root, regexp, chunk_size=CHUNK_SIZE):
+    """
+    将语料文件切成大约 chunk_size 字节的片段 只在换行之后切开
+    :return: [(文件名, 起始偏移, 结束偏移)] 按语料的顺序
+    """
+    chunks = []
+    for file in find_trainning_files(root, regexp):
+        size = os.path.getsize(file)
+        with open(file, 'rb') as f:
+            start = 0
+            while start < size:
+                f.seek(start + chunk_size)
+                f.readline()
+                end = min(f.tell(), size)
+                chunks.append((file, start, end))
+                start = end
+    return chunks
+
+
+def _tee_words(lines, words):
+    """
+    原样返回各行 同时统计词频 一遍读取同时统计词频和HMM
+    """
+    for line in lines:
+        words.update(line.split())
+        yield line
+
+
+def _count_lines(lines, count_hmm, count_words):
+    # 用Counter计数 FreqDist.update 每个词都要使缓存的总词频失效 慢得多
+    words = Counter() if count_words else None
+    if not count_hmm:
+        for line in lines:
+            words.update(line.split())
+        return None, words
+
+    if count_words:
+        lines = _tee_words(lines, words)
+    return HMMCounter().update(lines), words
+
+
+def _line_batches(lines, size):
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _count_lines_task(task):
+    lines, count_hmm, count_words = task
+    counter, words = _count_lines(lines, count_hmm, count_words)
+    return {'lead': None, 'trail': None, 'hmm': counter, 'words': words}
+
+
+def _count_file_task(task):
+    """
+    统计语料文件的一个片段
+    片段开头和末尾的词语可能和相邻片段（相邻文件）的连在一起 不在这里统计 交给主进程
+    """
+    file, start, end, count_hmm, count_words = task
+    with open(file, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf8')
+
+    # 开头和末尾没有空白时 第一个和最后一个词语可能还没完
+    i = 0
+    while i < len(text) and not text[i].isspace():
+        i += 1
+    if i == len(text):
+        return {'whole': text}
+    j = len(text)
+    while not text[j - 1].isspace():
+        j -= 1
+
+    counter, words = _count_lines(text[i:j].splitlines(), count_hmm,
+                                  count_words)
+    return {'lead': text[:i] or None, 'trail': text[j:] or None,
+            'hmm': counter, 'words': words}
+
+
+def _merge_chunks(results, count_hmm, count_words):
+    """
+    按语料的顺序合并各片段的统计结果 和整个语料一次统计完全一致
+    """
+    counter = HMMCounter() if count_hmm else None
+    words = Counter() if count_words else None
+    # 跨越片段边界还没统计的词语
+    pending = ''
+
+    def flush():
+        if count_hmm:
+            counter.update([pending])
+        if count_words:
+            words[pending] += 1
+
+    for result in results:
+        if 'whole' in result:
+            pending += result['whole']
+            continue
+
+        if result['lead'] is not None:
+            pending += result['lead']
+        if pending:
+            flush()
+
+        if count_hmm:
+            counter.merge(result['hmm'])
+        if count_words:
+            words.update(result['words'])
+        pending = result['trail'] or ''
+
+    if pending:
+        flush()
+    return counter, words
+
+
+def count_training(root=None, regexp=None, lines=None, workers=None,
+                   count_hmm=True, count_words=False):
+    """
+    统计语料的HMM发射计数 转移计数 以及词频
+    workers 大于1时 语料切成片段交给进程池分别统计 主进程按顺序合并 结果和单进程统计完全一致
+    :param root:
+    :param regexp:
+    :param lines: 可迭代的分好词的文本行 给了则不再读取 root 下的文件
+    :param workers: 进程数 默认单进程
+    :param count_hmm: 是否统计HMM
+    :param count_words: 是否统计词频
+    :return: (HMMCounter 或者 None, 词频 Counter 或者 None)
+    """
+    if lines is None:
+        if not workers or workers <= 1:
+            lines = iter_training_lines(root, regexp)
+        else:
+            tasks = [(file, start, end, count_hmm, count_words) for
+                     file, start, end in
+                     split_training_files(root, regexp, CHUNK_SIZE)]
+            with Pool(workers) as pool:
+                return _merge_chunks(pool.imap(_count_file_task, tasks),
+                                     count_hmm, count_words)
+
+    if not workers or workers <= 1:
+        return _count_lines(lines, count_hmm, count_words)
+
+    tasks = ((batch, count_hmm, count_words) for batch in
+             _line_batches(lines, CHUNK_LINES))
+    with Pool(workers) as pool:
+        return _merge_chunks(imap_bounded(pool, _count_lines_task, tasks,
+                                          workers * 2),
+                             count_hmm, count_words)
+
+
 def train_trans_matrix(root, regexp):
     """
     BB BM BE BS
@@ -50,37 +315,7 @@ def train_trans_matrix(root, regexp):
     pBM = C(BM)/C(B)
     :return:
     """
-    P_transMatrix = {'B': {'B': 0, 'E': 0, 'M': 0, 'S': 0},
-                     'E': {'B': 0, 'E': 0, 'M': 0, 'S': 0},
-                     'M': {'B': 0, 'E': 0, 'M': 0, 'S': 0},
-                     'S': {'B': 0, 'E': 0, 'M': 0, 'S': 0}}
-    bmes_content_list = prepare_bmes_content(root, regexp)
-
-    bmes_list = [item[0][-1] + item[1][-1] for item in
-                 bigrams(bmes_content_list)]
-
-    result_fd = FreqDist(bmes_list)
-
-    from itertools import product
-    for key in map(lambda a: a[0] + a[1],
-                   product(['B', 'M', 'E', 'S'], repeat=2)):
-        if key in result_fd:
-            a = key[0]
-            b = key[1]
-            P_transMatrix[a][b] = result_fd[key]
-
-    new_P_transMatrix = {}
-
-    for k in P_transMatrix:
-        for k2 in P_transMatrix[k]:
-            if P_transMatrix[k][k2] == 0:
-                pass
-            else:
-                if k not in new_P_transMatrix:
-                    new_P_transMatrix[k] = {}
-                new_P_transMatrix[k][k2] = P_transMatrix[k][k2]
-
-    return new_P_transMatrix
+    return train_hmm(iter_training_lines(root, regexp))['P_trans']
 
 
 def train_trans_matrix_to_file(root, regexp, output_dir='.'):
@@ -97,18 +332,7 @@ def train_trans_matrix_to_file(root, regexp, output_dir='.'):
 
 
 def train_emit_matrix(root, regexp):
-    P_emit = {'B': {}, 'E': {}, 'M': {}, 'S': {}}
-    bmes_content_list = prepare_bmes_content(root, regexp)
-
-    bmes_emit_list = [item[0][-1] + item[1][0] for item in
-                      bigrams(bmes_content_list)]
-
-    result_emit_fd = FreqDist(bmes_emit_list)
-
-    for k, v in result_emit_fd.items():
-        P_emit[k[0]][k[-1]] = v
-
-    return P_emit
+    return train_hmm(iter_training_lines(root, regexp))['P_emit']
 
 
 def train_emit_matrix_to_file(root, regexp, output_dir='.'):
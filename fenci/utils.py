@@ -56,6 +56,19 @@ def strdecode(sentence):
     return sentence
 
 
+def iter_offsets(words):
+    """
+    分词结果首尾相接正好还原原文 累加词长即可得到每个词的起止位置
+    :param words:
+    :return: (word, start, end)
+    """
+    start = 0
+    for word in words:
+        end = start + len(word)
+        yield word, start, end
+        start = end
+
+
 def write_json(file, data):
     """
     采用更稳妥的写文件方式，先在另外一个临时文件里面写，确保写操作无误之后再更改文件名
@@ -149,6 +162,29 @@ def read_training_content(root, regexp):
                     find_trainning_files(root, regexp)])
 
 
+def iter_training_lines(root, regexp):
+    """
+    逐行读取训练文本 不必一次读入全部语料
+    和 read_training_content 一样各文件首尾直接相连 文件末尾没有换行时和下一个文件的第一行相接
+    :param root:
+    :param regexp:
+    :return:
+    """
+    tail = ''
+    for file in find_trainning_files(root, regexp):
+        with open(file, encoding='utf8') as f:
+            for line in f:
+                if tail:
+                    line = tail + line
+                    tail = ''
+                if line.endswith('\n'):
+                    yield line
+                else:
+                    tail = line
+    if tail:
+        yield tail
+
+
 def get_resource_path(package_name, resource_path):
     """
     Python 3.7 兼容的包内资源路径获取函数
@@ -3,6 +3,7 @@
 
 import os
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 import fenci
 
 REQUIREMENTS = ['filelock']
@@ -10,6 +11,25 @@ this_directory = os.path.abspath(os.path.dirname(__file__))
 with open(os.path.join(this_directory, 'README.md'), encoding='utf-8') as f:
     long_description = f.read()
 
+
+class BuildPyCommand(build_py):
+    """
+    预编译的 default.model 不放进版本库 打包时由默认词典和默认HMM模型生成
+    """
+
+    def run(self):
+        super().run()
+
+        from fenci.cli import compile_model
+        from fenci.const import DEFAULT_DICT, DEFAULT_HMM_DATA, DEFAULT_MODEL
+
+        if not self.dry_run:
+            compile_model(
+                os.path.join(self.build_lib, 'fenci', DEFAULT_MODEL),
+                os.path.join(this_directory, 'fenci', DEFAULT_DICT),
+                os.path.join(this_directory, 'fenci', DEFAULT_HMM_DATA))
+
+
 setup(
     name='fenci',
     version=fenci.__version__,
@@ -31,4 +51,13 @@ setup(
     packages=find_packages(exclude=['examples', 'tests']),
     include_package_data=True,
     install_requires=REQUIREMENTS,
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': ['fenci=fenci.cli:main'],
+    },
+    cmdclass={
+        'build_py': BuildPyCommand,
+    },
 )
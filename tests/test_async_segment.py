@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import asyncio
+
+from fenci import Segment, AsyncSegment
+
+
+def test_async_lcut():
+    sentences = ['未来十年将有两个截然不同的互联网', '一个由美国领导',
+                 '另一个由中国领导。', '一个由美国领导']
+    segment = Segment()
+    async_segment = AsyncSegment(segment, max_batch_size=3)
+
+    async def main():
+        await async_segment.initialize()
+        return await asyncio.gather(*[async_segment.lcut(s) for s in sentences])
+
+    res = asyncio.run(main())
+    assert res == [segment.lcut(s) for s in sentences]
+
+
+def test_async_batching():
+    sentences = ['未来十年将有两个截然不同的互联网', '一个由美国领导',
+                 '另一个由中国领导。'] * 4
+    segment = Segment()
+    batch_sizes = []
+    lcut_many = segment.lcut_many
+
+    def counting_lcut_many(batch):
+        batch_sizes.append(len(batch))
+        return lcut_many(batch)
+
+    segment.lcut_many = counting_lcut_many
+    async_segment = AsyncSegment(segment, max_batch_size=5)
+
+    async def main():
+        await async_segment.initialize()
+        return await asyncio.gather(*[async_segment.lcut(s) for s in sentences])
+
+    res = asyncio.run(main())
+    assert res == [lcut_many([s])[0] for s in sentences]
+    # 同时到达的请求合并成批 而不是每个请求单独交给executor
+    assert batch_sizes == [5, 5, 2]
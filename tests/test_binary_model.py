@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import pickle
+
+from fenci import Segment
+from fenci.binary_model import open_mapped_model
+
+
+def test_mapped_model(tmp_path):
+    sentence = ('据 CNBC 报道，Google    前 CEO、Alphabet 前执行董事 Eric Schmidt '
+                '近日在参加旧金山的某高级私人活动时表示，未来十年将有两个截然不同的互联网')
+    segment = Segment()
+    model_file = str(tmp_path / 'fenci.model')
+    segment.export_model(model_file)
+
+    mapped = Segment(model_file=model_file)
+    assert mapped.lcut(sentence) == segment.lcut(sentence)
+    assert mapped.frozen
+
+    hmm = segment.hmm_segment
+    mapped_hmm = mapped.hmm_segment
+    mapped_hmm.check_initialized()
+    assert mapped_hmm.P_trans == hmm.P_trans
+    for state in 'BEMS':
+        for char in '报道网络互联喵':
+            assert mapped_hmm.P_emit[state].get(char, -1.0) == \
+                hmm.P_emit[state].get(char, -1.0)
+    assert dict(mapped_hmm.model_data) == dict(hmm.model_data)
+
+    data = pickle.dumps(mapped)
+    assert len(data) < 4096
+    restored = pickle.loads(data)
+    assert restored.model is mapped.model
+    assert restored.hmm_segment.P_emit['B'] is mapped_hmm.P_emit['B']
+    assert open_mapped_model(model_file) is mapped.model.word_fd.owner
+
+
+def test_default_model_up_to_date(tmp_path):
+    import os
+    import pytest
+    from fenci.cli import main
+    from fenci.segment import get_default_model_file
+
+    # default.model 不在版本库里 打包时才生成
+    if not os.path.isfile(get_default_model_file()):
+        pytest.skip('default.model is generated at build time')
+
+    model_file = str(tmp_path / 'default.model')
+    assert main(['compile', '-o', model_file]) == 0
+
+    with open(model_file, 'rb') as f1, \
+            open(get_default_model_file(), 'rb') as f2:
+        assert f1.read() == f2.read(), \
+            'please run: python -m fenci compile -o fenci/default.model'
+
+
+def test_compile_bad_path(tmp_path):
+    import pytest
+    from fenci.cli import main
+
+    hmm_data = tmp_path / 'typo.json'
+    with pytest.raises(SystemExit) as e:
+        main(['compile', '-o', str(tmp_path / 'x.model'), '--hmm',
+              str(hmm_data)])
+    assert e.value.code == 2
+    assert not hmm_data.exists()
+
+
+def test_load_prebuilt_model(tmp_path):
+    from fenci.binary_model import load_dict_model, load_hmm_model
+    from fenci.cli import compile_model
+    from fenci.model import DictModel
+    from fenci.utils import get_json_data, get_resource_path
+    from fenci.hmm_segment import HMMSegment
+
+    model_file = str(tmp_path / 'default.model')
+    compile_model(model_file)
+
+    segment = Segment()
+    model = load_dict_model(model_file)
+    expected = DictModel(segment.gen_word_fd(segment._get_dict_file()))
+    assert model.word_fd == expected.word_fd
+    assert model.prefix_dict == expected.prefix_dict
+    assert model.log_freq == expected.log_freq
+    assert model.total == expected.total
+
+    hmm = HMMSegment()
+    model_data = get_json_data(get_resource_path('fenci', 'hmm_data.json'))
+    prebuilt = load_hmm_model(model_file)
+    assert prebuilt['P_emit'] == hmm._prepare_P_emit(model_data)
+    assert prebuilt['P_trans'] == hmm._prepare_P_trans(model_data)
+    assert prebuilt['model_data']['P_trans'] == model_data['P_trans']
+
+
+def test_outdated_prebuilt_model(tmp_path, monkeypatch):
+    from fenci import segment as segment_module
+    from fenci import hmm_segment as hmm_module
+    from fenci.cli import compile_model
+    from fenci.hmm_segment import HMMSegment
+
+    # 假装自带的 default.model 是由另外一份词典和HMM模型编译的
+    dictionary = tmp_path / 'dict.txt'
+    dictionary.write_text('喵喵 3\n', encoding='utf8')
+    hmm_data = tmp_path / 'hmm_data.json'
+    hmm_data.write_text('{"P_emit": {"B": {"喵": 1}}, "P_trans": {"B": {"E": 1}}}',
+                        encoding='utf8')
+    model_file = str(tmp_path / 'default.model')
+    compile_model(model_file, str(dictionary), str(hmm_data))
+    monkeypatch.setattr(segment_module, 'get_default_model_file',
+                        lambda: model_file)
+
+    segment = Segment(cache_dir=str(tmp_path))
+    assert not segment._prebuilt_model_usable()
+    segment.check_initialized()
+    assert segment.word_fd == segment.gen_word_fd(segment._get_dict_file())
+
+    default_model = str(tmp_path / 'fresh.model')
+    compile_model(default_model)
+    for prebuilt, usable in ((default_model, True), (model_file, False)):
+        monkeypatch.setattr(hmm_module, 'get_resource_path',
+                            lambda package, name, prebuilt=prebuilt: prebuilt
+                            if name == 'default.model' else
+                            segment_module.get_resource_path(package, name))
+        assert HMMSegment()._prebuilt_model_usable() == usable
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import os
+import json
+
+from fenci import Segment
+from fenci.nltk_utils import FreqDist
+from fenci.model import DictModel, clear_shared_models
+from fenci.utils import write_json
+from fenci.cache import save_dict_cache, load_dict_cache, save_hmm_cache, \
+    load_hmm_cache, load_hmm_cache_model, read_cache_meta, export_cache_json, journal_file, evict_caches
+
+
+def test_cache_roundtrip(tmp_path):
+    cache_file = str(tmp_path / 'fenci.cache')
+    model = DictModel(FreqDist({'中国': 10, '中国人': 3, '人民': 0}))
+    model_data = {'P_emit': {'B': {'中': 3}}, 'P_trans': {'B': {'E': 1}}}
+
+    save_dict_cache(cache_file, model.word_fd, model.prefix_dict)
+    save_hmm_cache(cache_file, model_data)
+
+    loaded = load_dict_cache(cache_file)
+    assert loaded.word_fd == model.word_fd
+    assert loaded.prefix_dict == model.prefix_dict
+    assert loaded.log_freq == model.log_freq
+    assert loaded.total == model.total
+    assert load_hmm_cache(cache_file) == model_data
+    hmm_model = load_hmm_cache_model(cache_file)
+    assert hmm_model['P_emit']['B'] == {'中': 0.0}
+    assert hmm_model['P_trans'] == {'B': {'E': 0.0}}
+
+    meta = read_cache_meta(cache_file)
+    assert meta['word_fd_timestamp'] and meta['hmm_timestamp']
+
+    json_file = str(tmp_path / 'fenci.json')
+    export_cache_json(cache_file, json_file)
+    with open(json_file, encoding='utf8') as f:
+        data = json.load(f)
+    assert data['word_fd'] == {'中国': 10, '中国人': 3, '人民': 0}
+    assert data['P_emit'] == model_data['P_emit']
+
+
+def test_old_json_cache_ignored(tmp_path):
+    dict_file = tmp_path / 'dict.txt'
+    dict_file.write_text('机器学习 10\n中国 5\n', encoding='utf8')
+    segment = Segment(dictionary=str(dict_file), cache_dir=str(tmp_path))
+
+    cache_file = str(tmp_path / segment.cache_file)
+    write_json(cache_file, {'word_fd': {'中国': 1}, 'word_fd_timestamp': 1})
+    assert read_cache_meta(cache_file) is None
+
+    segment.initialize()
+    assert '机器学习' in segment.word_fd
+    assert read_cache_meta(cache_file)['word_fd_timestamp']
+
+
+def test_journal(tmp_path, monkeypatch):
+    from fenci import segment as segment_module
+    from fenci.cli import compile_model
+
+    cache_file = str(tmp_path / Segment().cache_file)
+    # 源码目录里没有 default.model 这里编译一份
+    model_file = str(tmp_path / 'default.model')
+    compile_model(model_file)
+    monkeypatch.setattr(segment_module, 'get_default_model_file',
+                        lambda: model_file)
+
+    def new_segment():
+        clear_shared_models()
+        segment = Segment(cache_dir=str(tmp_path))
+        segment.initialize()
+        return segment
+
+    # 默认词典直接载入预先编译好的模型 不写缓存 第一次保存时整体保存
+    s = new_segment()
+    assert read_cache_meta(cache_file) is None
+    s.add_word('截然不同的互联网', 10)
+    s.save_model()
+    snapshot = read_cache_meta(cache_file)['dict_snapshot']
+    assert not os.path.isfile(journal_file(cache_file, 'dict'))
+
+    s.add_word('截然不同的互联网', 5)
+    s.save_model()
+    assert read_cache_meta(cache_file)['dict_snapshot'] == snapshot
+    assert os.path.isfile(journal_file(cache_file, 'dict'))
+
+    s = new_segment()
+    assert s.word_fd['截然不同的互联网'] == 15
+    assert '截然不同的互联网' in s.lcut('截然不同的互联网')
+
+    s.compact_model()
+    assert read_cache_meta(cache_file)['dict_snapshot'] != snapshot
+    assert not os.path.isfile(journal_file(cache_file, 'dict'))
+    assert new_segment().word_fd['截然不同的互联网'] == 15
+
+    # 整体保存之后 旧日志失效
+    s.add_word('另一个新词语', 10)
+    s.save_model()
+    s.save_model(incremental=False)
+    assert not os.path.isfile(journal_file(cache_file, 'dict'))
+    assert new_segment().word_fd['另一个新词语'] == 10
+    clear_shared_models()
+
+
+def test_journal_write_failed(tmp_path, monkeypatch):
+    from fenci import segment as segment_module
+
+    clear_shared_models()
+    s = Segment(cache_dir=str(tmp_path))
+    s.add_word('截然不同的互联网', 10)
+    s.save_model()
+
+    # 写日志期间别的线程加的词 和写失败的改动 都要留到下次保存
+    def broken_append_journal(*args, **kwargs):
+        s.add_word('另一个新词语', 3)
+        raise OSError('disk full')
+
+    s.add_word('截然不同的互联网', 5)
+    monkeypatch.setattr(segment_module, 'append_journal',
+                        broken_append_journal)
+    try:
+        s.save_model()
+    except OSError:
+        pass
+    else:
+        assert False
+    assert s._dict_delta == {'截然不同的互联网': 5, '另一个新词语': 3}
+
+    monkeypatch.undo()
+    s.save_model()
+    assert not s._dict_delta
+
+    clear_shared_models()
+    s = Segment(cache_dir=str(tmp_path))
+    s.initialize()
+    assert s.word_fd['截然不同的互联网'] == 15
+    assert s.word_fd['另一个新词语'] == 3
+    clear_shared_models()
+
+
+def test_hmm_cache_log_tables(tmp_path, monkeypatch):
+    from fenci.hmm_segment import HMMSegment
+
+    clear_shared_models()
+    hmm = HMMSegment(cache_dir=str(tmp_path))
+    hmm.initialize()
+    hmm.save_model(incremental=False)
+    expected = hmm.model
+
+    # 缓存里的对数概率表直接使用 不再重新计算
+    def fail(self, model_data=None):
+        raise AssertionError('log tables should be loaded from cache')
+
+    monkeypatch.setattr(HMMSegment, '_prepare_P_emit', fail)
+    monkeypatch.setattr(HMMSegment, '_prepare_P_trans', fail)
+    clear_shared_models()
+    hmm = HMMSegment(cache_dir=str(tmp_path))
+    hmm.initialize()
+    assert hmm.P_emit == expected['P_emit']
+    assert hmm.P_trans == expected['P_trans']
+    assert hmm.model_data == expected['model_data']
+    clear_shared_models()
+
+
+def test_cache_per_dictionary(tmp_path):
+    dict_file = tmp_path / 'dict.txt'
+    dict_file.write_text('机器学习 10\n中国 5\n', encoding='utf8')
+
+    custom = Segment(dictionary=str(dict_file), cache_dir=str(tmp_path))
+    default = Segment(cache_dir=str(tmp_path))
+    assert custom.cache_file != default.cache_file
+    assert custom.cache_file == Segment(dictionary=str(dict_file)).cache_file
+
+    custom.initialize()
+    default.initialize()
+    default.add_word('截然不同的互联网', 10)
+    default.save_model()
+    assert read_cache_meta(str(tmp_path / custom.cache_file))
+    assert read_cache_meta(str(tmp_path / default.cache_file))
+
+    # 词典内容变了 换一份缓存
+    dict_file.write_text('机器学习 10\n中国 6\n', encoding='utf8')
+    assert Segment(dictionary=str(dict_file)).cache_file != custom.cache_file
+    clear_shared_models()
+
+
+def test_evict_caches(tmp_path):
+    for i in range(3):
+        cache_file = str(tmp_path / f'fenci-{i}.cache')
+        save_dict_cache(cache_file, FreqDist({'中国': i + 1}))
+        os.utime(cache_file, (i, i))
+    (tmp_path / 'other.txt').write_text('x')
+
+    size = os.path.getsize(str(tmp_path / 'fenci-0.cache'))
+    removed = evict_caches(str(tmp_path), max_bytes=size * 2,
+                           keep=(str(tmp_path / 'fenci-0.cache'),))
+    assert removed == [str(tmp_path / 'fenci-1.cache')]
+    assert sorted(os.listdir(str(tmp_path))) == [
+        'fenci-0.cache', 'fenci-2.cache', 'other.txt']
+
+
+def test_negative_freq(tmp_path):
+    from fenci.binary_model import load_dict_model
+
+    clear_shared_models()
+    s = Segment(cache_dir=str(tmp_path))
+    s.add_word('截然不同的互联网', 2)
+    s.save_model()
+    s.add_word('截然不同的互联网', -5)
+    s.save_model()
+    s.compact_model()
+    s.save_model(incremental=False)
+
+    clear_shared_models()
+    s = Segment(cache_dir=str(tmp_path))
+    s.initialize()
+    assert s.word_fd['截然不同的互联网'] == -3
+
+    model_file = str(tmp_path / 'fenci.model')
+    s.export_model(model_file)
+    assert load_dict_model(model_file).word_fd['截然不同的互联网'] == -3
+    mapped = Segment(model_file=model_file)
+    mapped.initialize()
+    assert mapped.word_fd['截然不同的互联网'] == -3
+    s.freeze()
+    assert s.word_fd['截然不同的互联网'] == -3
+    clear_shared_models()
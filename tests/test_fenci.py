@@ -21,3 +21,132 @@ def test_cut():
                    '表示', '，', '未来', '十年', '将', '有', '两个', '截然不同', '的',
                    '互联网', '：', '一个', '由', '美国', '领导', '，', '另', '一个', '由', '中国',
                    '领导', '。', '。', '。']
+
+
+def test_get_DAG():
+    segment = Segment()
+    sentence = '未来十年将有两个截然不同的互联网'
+    DAG = segment.get_DAG(sentence)
+
+    N = len(sentence)
+    for k in range(N):
+        expected = [i for i in range(k, N)
+                    if segment.word_fd.get(sentence[k:i + 1], 0) > 0] or [k]
+        assert DAG[k] == expected
+
+    segment.add_word('截然不同的互联网', 10)
+    assert 15 in segment.get_DAG(sentence)[8]
+
+
+def test_log_freq():
+    import math
+    segment = Segment()
+    segment.initialize()
+    segment.add_word('截然不同的互联网', 10)
+
+    assert segment.total == segment.word_fd.N()
+    assert segment.logtotal == math.log(segment.word_fd.N())
+    assert segment.log_freq['截然不同的互联网'] == math.log(
+        segment.word_fd['截然不同的互联网'])
+
+
+def test_lcut_many():
+    segment = Segment()
+    sentences = ['未来十年将有两个截然不同的互联网', '一个由美国领导',
+                 '未来十年将有两个截然不同的互联网', '', '另一个由中国领导。']
+
+    res = segment.lcut_many(iter(sentences), batch_size=2)
+    assert res == [segment.lcut(s) for s in sentences]
+    assert res[0] is not res[2]
+    assert segment.tokenize_sents(sentences) == res
+
+    hmm = segment.hmm_segment
+    sentences = ['喵嗷呜啊嘿哈abc 12.5%喵嗷', '嘿哈', '喵嗷呜啊嘿哈abc 12.5%喵嗷']
+    assert hmm.lcut_many(sentences) == [hmm.lcut(s) for s in sentences]
+
+
+def test_cut_file(tmp_path):
+    segment = Segment()
+    text = ('未来十年将有两个截然不同的互联网：一个由美国领导，另一个由中国领导。\n\n'
+            'Google    前 CEO、Alphabet 前执行董事 Eric Schmidt\n') * 10
+    src = tmp_path / 'src.txt'
+    src.write_text(text, encoding='utf8')
+
+    assert list(segment.cut_file(str(src), chunk_size=7)) == segment.lcut(text)
+
+    with open(src, 'rb') as f:
+        assert list(segment.cut_file(f, chunk_size=5)) == segment.lcut(text)
+    assert list(segment.cut_stream(iter(text))) == segment.lcut(text)
+
+    gbk_src = tmp_path / 'gbk.txt'
+    gbk_src.write_text(text, encoding='gbk')
+    with open(gbk_src, 'rb') as f:
+        assert list(segment.cut_file(f, encoding='gbk', chunk_size=5)) == \
+            segment.lcut(text)
+
+    dst = tmp_path / 'dst.txt'
+    count = segment.cut_file(str(src), str(dst), sep='/')
+    assert count == len(segment.lcut(text))
+    assert dst.read_text(encoding='utf8') == '/'.join(segment.lcut(text))
+
+
+def test_span_tokenize():
+    segment = Segment()
+    s = '据 CNBC 报道，Google    前 CEO、Alphabet 前执行董事 Eric Schmidt 近日在参加旧金山的某高级私人活动时表示'
+
+    spans = list(segment.span_tokenize(s))
+    assert [s[start:end] for start, end in spans] == segment.lcut(s)
+    assert list(segment.span_array(s)) == [i for span in spans for i in span]
+    assert segment.lcut(s, with_offsets=True)[1] == (' ', 1, 2)
+
+    assert list(segment.span_tokenize_sents([s, s])) == [spans, spans]
+    assert list(segment.span_tokenize_sents([s], compact=True)) == [
+        segment.span_array(s)]
+
+    hmm_spans = list(segment.hmm_segment.span_tokenize(s))
+    assert [s[start:end] for start, end in hmm_spans] == \
+        segment.hmm_segment.lcut(s)
+
+
+def test_cut_for_search():
+    segment = Segment()
+    s = '小明硕士毕业于中国科学院计算所，后在日本京都大学深造'
+
+    res = segment.lcut_for_search(s)
+    assert res[4:9] == ['中国', '科学', '学院', '科学院', '中国科学院']
+    assert [w for w in res if w in segment.lcut(s)] == segment.lcut(s)
+
+    for word, start, end in segment.lcut_for_search(s, with_offsets=True):
+        assert s[start:end] == word
+
+
+def test_cut_all():
+    segment = Segment()
+    s = '小明硕士毕业于中国科学院计算所，后在日本京都大学深造'
+
+    res = segment.lcut_all(s, with_offsets=True)
+    DAG = segment.get_DAG('小明硕士毕业于中国科学院计算所')
+    assert sorted((k, j + 1) for k in DAG for j in DAG[k]) == sorted(
+        (start, end) for word, start, end in res if end <= 15)
+    for word, start, end in res:
+        assert s[start:end] == word
+
+    assert '中国科学院' in segment.lcut_all(s)
+    min_freq = segment.word_fd['中国科学院'] + 1
+    assert '中国科学院' not in segment.lcut_all(s, min_freq=min_freq)
+
+
+def test_numpy_not_imported():
+    import os
+    import subprocess
+    import sys
+
+    # numpy 只在 viterbi_backend='numpy' 时才导入
+    code = ('import sys\n'
+            'from fenci import Segment\n'
+            'Segment().lcut("未来十年将有两个截然不同的互联网")\n'
+            'print("numpy" in sys.modules)\n')
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=os.path.dirname(os.path.dirname(
+                                         os.path.abspath(__file__))))
+    assert output.strip() == b'False'
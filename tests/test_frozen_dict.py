@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import pytest
+
+from fenci import Segment
+from fenci.nltk_utils import FreqDist
+from fenci.frozen_dict import FrozenWordDict
+
+
+def test_frozen_word_dict():
+    fd = FrozenWordDict.from_freq_dist(
+        FreqDist({'中国': 10, '中国人': 3, '人民': 0, '国': 7}))
+
+    assert len(fd) == 4
+    assert fd.N() == 20
+    assert fd['中国'] == 10
+    assert fd.get('中') is None
+    assert '人民' in fd
+    assert dict(fd) == {'中国': 10, '中国人': 3, '人民': 0, '国': 7}
+
+    assert fd.prefix_get('中') == 0
+    assert fd.prefix_get('中国') == 10
+    assert fd.prefix_get('人民') == 0
+    assert fd.prefix_get('民') is None
+    assert fd.log_freq_get('人民') is None
+
+
+def test_hash_table():
+    from fenci.frozen_dict import build_hash_table
+
+    fd = FrozenWordDict.from_freq_dist(
+        FreqDist({'中国': 10, '中国人': 3, '中国人民': 2, '人民': 0, '国': 7,
+                  'abc': 1}))
+    words = [bytes(fd.blob[fd.offsets[i]:fd.offsets[i + 1]]) for i in
+             range(len(fd))]
+    hashed = FrozenWordDict(fd.blob, fd.offsets, fd.freqs,
+                            hash_table=build_hash_table(words))
+
+    for frag in ['中', '中国', '中国人', '中国人民', '中国人民们', '人', '人民',
+                 '民', '国', 'a', 'ab', 'abc', 'abcd', 'b']:
+        assert hashed.prefix_get(frag) == fd.prefix_get(frag), frag
+        assert hashed.get(frag) == fd.get(frag), frag
+        assert hashed.log_freq_get(frag) == fd.log_freq_get(frag), frag
+    assert dict(hashed) == dict(fd)
+
+
+def test_freeze():
+    segment = Segment()
+    sentence = '未来十年将有两个截然不同的互联网：一个由美国领导，另一个由中国领导。'
+    res1 = segment.lcut(sentence)
+    nbytes = segment.dictionary_nbytes()
+
+    segment.freeze()
+    assert segment.lcut(sentence) == res1
+    assert segment.dictionary_nbytes() < nbytes
+
+    with pytest.raises(Exception):
+        segment.add_word('截然不同的互联网')
+
+    segment.unfreeze()
+    segment.add_word('截然不同的互联网')
+    assert '截然不同的互联网' in segment.lcut(sentence)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import re
+import pickle
+
+import pytest
+
+from fenci.hmm_segment import HMMSegment, viterbi, start_P
+
+np = pytest.importorskip('numpy')
+
+from fenci.hmm_numpy import NumpyViterbi
+
+
+def test_numpy_viterbi():
+    hmm = HMMSegment()
+    hmm.initialize()
+    engine = NumpyViterbi(start_P, hmm.P_trans, hmm.P_emit)
+
+    text = ('据 CNBC 报道，Google 前 CEO、Alphabet 前执行董事 Eric Schmidt '
+            '近日在参加旧金山的某高级私人活动时表示，未来十年将有两个截然不同的互联网'
+            '喵嗷呜啊嘿哈')
+    han = ''.join(re.findall('[一-鿕]', text))
+    for i in range(len(han)):
+        for j in range(i + 1, min(len(han), i + 40) + 1):
+            sentence = han[i:j]
+            assert engine(sentence) == viterbi(
+                sentence, 'BMES', start_P, hmm.P_trans, hmm.P_emit)
+
+
+def test_numpy_backend():
+    sentence = '未来十年将有两个截然不同的互联网喵嗷呜啊嘿哈'
+    hmm = HMMSegment(viterbi_backend='numpy')
+    assert hmm.lcut(sentence) == HMMSegment().lcut(sentence)
+
+    restored = pickle.loads(pickle.dumps(hmm))
+    assert restored._numpy_viterbi is None
+    assert restored.lcut(sentence) == hmm.lcut(sentence)
+
+
+def test_numpy_batch():
+    hmm = HMMSegment()
+    hmm.initialize()
+    engine = NumpyViterbi(start_P, hmm.P_trans, hmm.P_emit)
+
+    text = '近日在参加旧金山的某高级私人活动时表示未来十年将有两个截然不同的互联网喵嗷呜啊嘿哈'
+    obs_list = [text[i:i + n] for n in (1, 2, 3, 5, 8) for i in
+                range(0, len(text) - n, 3)]
+    assert engine.batch(obs_list) == [
+        viterbi(obs, 'BMES', start_P, hmm.P_trans, hmm.P_emit) for obs in
+        obs_list]
+
+    from fenci import Segment
+    segment = Segment()
+    sentences = ['据 CNBC 报道，喵嗷呜啊嘿哈', '未来十年将有两个截然不同的互联网', '嘿哈嘿哈']
+    expected = [segment.lcut(s) for s in sentences]
+    segment.hmm_segment.viterbi_backend = 'numpy'
+    assert segment.lcut_many(sentences) == expected
@@ -15,3 +15,36 @@ def test_load_dict():
 
     assert '机器学习' not in res1
     assert '机器学习' in res2
+
+
+def test_add_words(tmp_path):
+    from fenci.segment import Segment
+    from fenci.model import DictModel
+
+    words = ['机器学习', ('截然不同的互联网', 10), ('机器学习', 5), '新型计算机学科']
+
+    s1 = Segment()
+    for item in words:
+        if isinstance(item, str):
+            s1.add_word(item)
+        else:
+            s1.add_word(*item)
+
+    s2 = Segment()
+    s2.add_words(words)
+
+    assert s2.word_fd == s1.word_fd
+    assert s2.prefix_dict == s1.prefix_dict
+    assert s2.log_freq == s1.log_freq
+    assert s2.total == s1.total == s2.word_fd.N() == sum(s2.word_fd.values())
+    assert s2.word_fd['机器学习'] == 6
+
+    expected = DictModel(s2.word_fd.copy())
+    assert s2.prefix_dict == expected.prefix_dict
+
+    userdict = tmp_path / 'userdict.txt'
+    userdict.write_text('机器学习\n\n截然不同的互联网 10 n\n机器学习 5\n新型计算机学科\n',
+                        encoding='utf8')
+    s3 = Segment()
+    s3.load_userdict(str(userdict))
+    assert s3.word_fd == s2.word_fd
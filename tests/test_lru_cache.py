@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+from fenci import Segment
+from fenci.lru_cache import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.info()['hits'] == 1
+    assert cache.info()['misses'] == 1
+    assert cache.info()['evictions'] == 1
+
+    cache = LRUCache(max_size=None, max_bytes=10, sizeof=lambda k, v: v)
+    cache.put('a', 6)
+    cache.put('b', 6)
+    assert 'a' not in cache and 'b' in cache
+    cache.put('c', 11)
+    assert 'c' not in cache
+
+
+def test_block_cache():
+    segment = Segment()
+    segment.enable_cache(max_size=100)
+    sentence = '机器学习是一门新型的计算机学科。机器学习是一门新型的计算机学科。'
+
+    res1 = segment.lcut(sentence)
+    assert segment.cache_info()['hits'] == 1
+    assert segment.cache_info()['misses'] == 1
+
+    segment.add_word('机器学习', 1000)
+    res2 = segment.lcut(sentence)
+    assert '机器学习' not in res1
+    assert '机器学习' in res2
+    assert segment.cache_info()['size'] == 1
+
+
+def test_hmm_cache(tmp_path):
+    from fenci.hmm_segment import HMMSegment
+
+    hmm = HMMSegment(cache_dir=str(tmp_path))
+    expected = hmm.lcut('林志玲和范冰冰来了')
+    expected_many = hmm.lcut_many(['范冰冰', '林志玲'])
+    hmm.enable_cache(max_size=100, max_key_length=4)
+
+    assert hmm.lcut('林志玲和范冰冰来了') == expected
+    assert hmm.lcut('林志玲和范冰冰来了') == expected
+    assert hmm.cache_info()['size'] == 0
+
+    assert hmm.lcut('范冰冰') == hmm.lcut('范冰冰')
+    assert hmm.cache_info()['hits'] == 1
+    assert hmm.cache_info()['misses'] == 1
+    assert hmm.lcut_many(['范冰冰', '林志玲']) == expected_many
+    assert hmm.cache_info()['hits'] == 2
+
+    (tmp_path / 'train.txt').write_text('范 冰冰 林志玲 范冰 冰\n',
+                                        encoding='utf8')
+    hmm.training(str(tmp_path), '.*\\.txt', training_mode='replace')
+    words = hmm.lcut('范冰冰')
+    assert hmm.cache_info()['size'] == 1
+    hmm.disable_cache()
+    assert hmm.lcut('范冰冰') == words
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import threading
+
+from fenci import Segment
+from fenci.model import get_shared_model
+
+
+def test_shared_model():
+    s1 = Segment()
+    s2 = Segment()
+    s1.initialize()
+    s2.initialize()
+
+    assert s1.model is s2.model
+    assert s1.hmm_segment.P_emit is s2.hmm_segment.P_emit
+
+    s1.add_word('截然不同的互联网', 10)
+    assert s1.model is not s2.model
+    assert '截然不同的互联网' in s1.word_fd
+    assert '截然不同的互联网' not in s2.word_fd
+    assert '截然不同的互联网' not in Segment().lcut('截然不同的互联网')
+
+
+def test_shared_model_load_once():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return object()
+
+    models = []
+    threads = [threading.Thread(
+        target=lambda: models.append(get_shared_model('test', loader)))
+        for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert all(model is models[0] for model in models)
+
+
+def test_snapshot_update():
+    sentence = '未来十年将有两个截然不同的互联网'
+    s = Segment()
+    before = s.lcut(sentence)
+    old_model = s.model
+
+    s.add_word('截然不同的互联网', 10)
+    after = s.lcut(sentence)
+    assert s.model is not old_model
+    assert '截然不同的互联网' not in old_model.word_fd
+    assert '截然不同的互联网' in after
+
+    # 出错则放弃期间的所有修改
+    model = s.model
+    try:
+        with s.batch_update():
+            s.add_word('两个截然', 10)
+            raise ValueError
+    except ValueError:
+        pass
+    assert s.model is model
+    assert '两个截然' not in s.word_fd
+
+    # 期间仍用原来的模型 结束时一次性替换
+    with s.batch_update():
+        s.add_word('两个截然', 10)
+        s.add_words(['将有两个'])
+        assert s.model is model
+    assert '两个截然' in s.word_fd and '将有两个' in s.word_fd
+
+    results = set()
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            results.add(tuple(s2.lcut(sentence)))
+
+    s2 = Segment()
+    s2.lcut(sentence)
+    threads = [threading.Thread(target=reader) for i in range(4)]
+    for t in threads:
+        t.start()
+    s2.add_words([('截然不同的互联网', 10)] + [
+        (f'词语{i}', 1) for i in range(1000)])
+    s2.add_words([('将有两个', 10)])
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert results <= {tuple(before), tuple(after),
+                       tuple(s2.lcut(sentence))}
+
+
+def test_overlay_update(monkeypatch):
+    from fenci.model import DictModel
+    from fenci.nltk_utils import FreqDist
+
+    base = DictModel(FreqDist({'互联网': 10, '截然不同': 5}))
+    model = base.updated({'截然不同的互联网': 3, '互联网': 2})
+    # 新模型和旧模型共用基础词典 只记录改动
+    assert model.word_fd.base is base.word_fd
+    assert base.word_fd == {'互联网': 10, '截然不同': 5}
+    assert model.word_fd == {'互联网': 12, '截然不同': 5, '截然不同的互联网': 3}
+    assert model.total == model.word_fd.N() == 20
+    assert model.prefix_dict['截然不同的'] == 0
+    assert '截然不同的' not in base.prefix_dict
+
+    expected = DictModel(model.word_fd.copy())
+    assert model.prefix_dict == expected.prefix_dict
+    assert model.log_freq == expected.log_freq
+
+    # 改动多了合并成新的基础词典
+    monkeypatch.setattr(DictModel, 'MERGE_SIZE', 10)
+    merged = model.updated({f'词语{i}': 1 for i in range(10)})
+    assert merged._delta is None
+    assert merged.word_fd is not base.word_fd
+    assert isinstance(merged.word_fd, FreqDist)
+    assert merged.total == merged.word_fd.N() == 30
+    assert len(model.word_fd) == 3
+
+
+def test_update_matches_rebuild(monkeypatch):
+    from fenci.model import DictModel
+    from fenci.nltk_utils import FreqDist
+
+    def check(model):
+        rebuilt = DictModel(model.word_fd.copy())
+        assert model.word_fd == rebuilt.word_fd
+        assert model.prefix_dict == rebuilt.prefix_dict
+        assert model.log_freq == rebuilt.log_freq
+        assert model.total == rebuilt.total
+
+    base = DictModel(FreqDist({'中国': 10, '中': 5, '国': 3}))
+    # 词频降到0或者以下的词不再有对数词频
+    model = base.updated({'中': -5, '国': -4})
+    assert model.log_freq.get('中') is None
+    assert '国' not in model.log_freq
+    assert len(model.log_freq) == 1
+    check(model)
+
+    check(model.updated({'中': 2}))
+    assert base.log_freq['中'] > 0
+
+    plain = DictModel(FreqDist({'中国': 10, '中': 5}))
+    plain.update({'中': -5})
+    check(plain)
+
+    monkeypatch.setattr(DictModel, 'MERGE_SIZE', 2)
+    check(model.updated({'中国人': 1, '人民': 2}))
+
+
+def test_update_lock_per_instance():
+    s1 = Segment()
+    s2 = Segment()
+    s1.initialize()
+    s2.initialize()
+
+    # 一个分词器的 batch_update 不妨碍另一个分词器修改词典
+    with s1.batch_update():
+        s1.add_word('截然不同的互联网', 10)
+        t = threading.Thread(target=s2.add_word, args=('两个截然', 10))
+        t.start()
+        t.join(timeout=5)
+        assert not t.is_alive()
+    assert '两个截然' in s2.word_fd
+    assert '截然不同的互联网' in s1.word_fd
+
+    # 修改之后的词典仍然可以像 FreqDist 一样查询
+    word_fd = s2.word_fd
+    assert word_fd.N() == s2.total
+    assert word_fd.freq('两个截然') == word_fd['两个截然'] / s2.total
+    assert word_fd.most_common(1)[0][1] == word_fd[word_fd.max()]
+    assert word_fd['不存在的词语'] == 0
+
+
+def test_bulk_update_merges_first(monkeypatch):
+    from fenci.model import DictModel, OverlayDict
+    from fenci.nltk_utils import FreqDist
+
+    monkeypatch.setattr(DictModel, 'MERGE_SIZE', 3)
+    model = DictModel(FreqDist({'中国': 10})).updated({'中': 1})
+    assert isinstance(model.word_fd, OverlayDict)
+
+    # 大批量的改动不经过叠加视图 直接更新合并之后的普通字典
+    lookups = []
+    monkeypatch.setattr(OverlayDict, '__contains__',
+                        lambda self, key: lookups.append(key))
+    bulk = model.updated({f'词语{i}': 1 for i in range(4)})
+    assert bulk._delta is None
+    assert not lookups
+    assert bulk.word_fd == {'中国': 10, '中': 1, '词语0': 1, '词语1': 1,
+                            '词语2': 1, '词语3': 1}
+
+
+def test_initialize_independent(tmp_path, monkeypatch):
+    userdict = tmp_path / 'dict.txt'
+    userdict.write_text('喵喵 3\n', encoding='utf8')
+    slow = Segment(dictionary=str(userdict), cache_dir=str(tmp_path))
+
+    started = threading.Event()
+    release = threading.Event()
+    load_model = Segment._load_model
+
+    def slow_load_model(self):
+        if self is slow:
+            started.set()
+            release.wait(10)
+        return load_model(self)
+
+    monkeypatch.setattr(Segment, '_load_model', slow_load_model)
+
+    t = threading.Thread(target=slow.check_initialized)
+    t.start()
+    assert started.wait(10)
+    # 自定义词典还在载入 不妨碍默认词典的分词器初始化
+    assert Segment().lcut('截然不同') == ['截然不同']
+    assert t.is_alive()
+
+    release.set()
+    t.join()
+    assert '喵喵' in slow.word_fd
@@ -40,3 +40,20 @@ def test_multiprocess():
     from multiprocessing import Pool
     with Pool(5) as p:
         p.map(segment_test, range(0, 8))
+
+
+def test_cut_parallel():
+    segment = Segment()
+    text = ('据 CNBC 报道，Google    前 CEO、Alphabet 前执行董事 Eric Schmidt '
+            '近日在参加旧金山的某高级私人活动时表示，\n\n未来十年将有两个截然不同的互联网：'
+            '一个由美国领导，另一个由中国领导。。。\n') * 20
+
+    segment.enable_parallel(2)
+    try:
+        assert segment.lcut_parallel(text, chunk_size=50) == segment.lcut(text)
+
+        lines = text.splitlines(keepends=True)
+        assert segment.lcut_parallel(lines, chunk_size=50) == [
+            word for line in lines for word in segment.lcut(line)]
+    finally:
+        segment.disable_parallel()
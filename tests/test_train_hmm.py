@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+from fenci.nltk_utils import FreqDist, bigrams
+from fenci import train_hmm as train_hmm_module
+from fenci.train_hmm import prepare_bmes_content, train_hmm, \
+    train_emit_matrix, train_trans_matrix, count_training
+from fenci.utils import iter_training_lines, read_training_content
+from fenci.hmm_segment import HMMSegment
+from fenci import Segment
+
+
+def test_train_hmm(tmp_path):
+    (tmp_path / 'a.txt').write_text('我 扔 了 两颗 手榴弹 ，\n他 一下子 出 溜',
+                                    encoding='utf8')
+    # 和原来一样 上一个文件末尾没有换行时直接和这个文件相接
+    (tmp_path / 'b.txt').write_text('下去 。\n中华人民共和国 成立 了\n',
+                                    encoding='utf8')
+    root = str(tmp_path)
+
+    bmes = prepare_bmes_content(root, '.*\\.txt')
+    P_emit = {'B': {}, 'E': {}, 'M': {}, 'S': {}}
+    for k, v in FreqDist(a[-1] + b[0] for a, b in bigrams(bmes)).items():
+        P_emit[k[0]][k[-1]] = v
+    P_trans = {}
+    for k, v in FreqDist(a[-1] + b[-1] for a, b in bigrams(bmes)).items():
+        P_trans.setdefault(k[0], {})[k[1]] = v
+
+    assert train_emit_matrix(root, '.*\\.txt') == P_emit
+    assert train_trans_matrix(root, '.*\\.txt') == P_trans
+
+    lines = list(iter_training_lines(root, '.*\\.txt'))
+    assert ''.join(lines) == read_training_content(root, '.*\\.txt')
+    assert train_hmm(iter(lines)) == {'P_emit': P_emit, 'P_trans': P_trans}
+
+
+def test_training_lines(tmp_path):
+    hmm = HMMSegment(cache_dir=str(tmp_path))
+    lines = ['范 冰冰 林志玲\n', '范冰 冰\n']
+    hmm.training(lines=iter(lines), training_mode='replace')
+    assert hmm.model_data == train_hmm(lines)
+
+
+def test_parallel_training(tmp_path, monkeypatch):
+    (tmp_path / 'a.txt').write_text('我 扔 了\r\n两颗 手榴弹 ，\r\n他 一下子 出 溜',
+                                    encoding='utf8')
+    (tmp_path / 'b.txt').write_text('', encoding='utf8')
+    (tmp_path / 'c.txt').write_text('下去', encoding='utf8')
+    (tmp_path / 'd.txt').write_text(' 。 中华人民共和国\n成立 了\n',
+                                    encoding='utf8')
+    root = str(tmp_path)
+
+    counter, words = count_training(root, '.*\\.txt', count_words=True)
+    # 片段切得很小 每一行都是一个片段
+    monkeypatch.setattr(train_hmm_module, 'CHUNK_SIZE', 1)
+    p_counter, p_words = count_training(root, '.*\\.txt', workers=2,
+                                        count_words=True)
+    assert p_counter.counts() == counter.counts()
+    assert p_words == words
+
+    lines = list(iter_training_lines(root, '.*\\.txt'))
+    monkeypatch.setattr(train_hmm_module, 'CHUNK_LINES', 2)
+    p_counter, p_words = count_training(lines=iter(lines), workers=2,
+                                        count_words=True)
+    assert p_counter.counts() == counter.counts()
+    assert p_words == words
+
+    s1 = Segment(cache_dir=str(tmp_path))
+    s1.training_hmm(root, '.*\\.txt', update_dict=True)
+    s2 = Segment(cache_dir=str(tmp_path))
+    s2.training_hmm(root, '.*\\.txt', update_dict=True, workers=2)
+    assert s1.word_fd == s2.word_fd
+    assert s1.hmm_segment.model_data == s2.hmm_segment.model_data